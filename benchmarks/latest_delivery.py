@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""قياس زمن فحص التسليم المكرر (check_existing_delivery) مع نمو جدول التسليمات.
+
+ينشئ قاعدة بيانات مؤقتة ويملؤها تدريجياً حتى أكبر حجم مطلوب، ويقيس عند كل حجم:
+- الفحص الفعلي عبر الفهرس idx_deliveries_campaign_latest
+- نفس الاستعلام مع NOT INDEXED للمقارنة (مسح كامل للجدول)
+
+الاستخدام:
+    python benchmarks/latest_delivery.py
+    python benchmarks/latest_delivery.py --sizes 1000 10000 100000 --lookups 5000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def timed(func, args_list):
+    """زمن كل استدعاء بالميكروثانية"""
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000],
+                        help="أحجام جدول التسليمات المقاسة")
+    parser.add_argument("--lookups", type=int, default=2_000, help="عدد الفحوصات عند كل حجم")
+    parser.add_argument("--scan-lookups", type=int, default=20, help="عدد الفحوصات بدون فهرس عند كل حجم")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="latest_delivery_")
+    os.environ["DATA_DIR"] = data_dir
+    sys.path.insert(0, ROOT)
+    import bot
+
+    bot.init_database()
+    campaign = bot.get_active_campaign()
+    rng = random.Random(args.seed)
+
+    # كل عضو له تسليمان في المتوسط، ونصف الفحوصات لجوازات بلا تسليم
+    def passport(n):
+        return f"P{n:08d}"
+
+    def check_by_scan(passport_value):
+        with bot.get_db_connection() as conn:
+            conn.execute(f"""
+                SELECT id, supervisor, passport, member_name, delivery_date
+                FROM deliveries NOT INDEXED
+                WHERE campaign_id = {bot.ACTIVE_CAMPAIGN_ID_SQL} AND passport_key = ?
+                ORDER BY id DESC LIMIT 1
+            """, (bot.normalize_passport(passport_value),)).fetchone()
+
+    with bot.get_db_connection() as conn:
+        plan = conn.execute(f"""
+            EXPLAIN QUERY PLAN
+            SELECT id, supervisor, passport, member_name, delivery_date
+            FROM deliveries
+            WHERE campaign_id = {bot.ACTIVE_CAMPAIGN_ID_SQL} AND passport_key = ?
+            ORDER BY id DESC LIMIT 1
+        """, ("P",)).fetchall()
+    print("query plan:", "; ".join(row[3] for row in plan))
+    print(f"{'deliveries':>12} {'probe p50 µs':>13} {'probe p99 µs':>13} {'scan p50 µs':>12}")
+
+    total = 0
+    for size in sorted(args.sizes):
+        with bot.get_db_connection() as conn:
+            for chunk in bot.chunked(range(total, size), 50_000):
+                conn.executemany("""
+                    INSERT INTO deliveries (supervisor, passport, passport_key, member_name, campaign_id)
+                    VALUES (?, ?, ?, ?, ?)
+                """, [(f"s{n % 20}", passport(n // 2), passport(n // 2), f"member {n // 2}", campaign["id"])
+                      for n in chunk])
+            conn.execute("ANALYZE")
+        total = size
+
+        members = max(size // 2, 1)
+        lookups = [(passport(rng.randrange(members * 2)),) for _ in range(args.lookups)]
+        timed(bot.check_existing_delivery, lookups[:100])  # تسخين الاتصال وذاكرة الصفحات
+        probe = sorted(timed(bot.check_existing_delivery, lookups))
+        scan = timed(check_by_scan, lookups[:args.scan_lookups])
+
+        print(f"{size:>12,} {statistics.median(probe):>13.1f} {probe[int(len(probe) * 0.99) - 1]:>13.1f} "
+              f"{statistics.median(scan):>12.1f}")
+
+    bot.close_db_pool()
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
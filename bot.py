@@ -6,85 +6,46 @@ import sqlite3
 import logging
 from datetime import datetime, date
 from enum import Enum, auto
-from typing import List, Dict, Optional, Tuple
+from typing import IO, Callable, Iterable, Iterator, List, Dict, Optional, Sequence, Tuple
 import re
-
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+import io
+import json
+import pickle
+import hashlib
+import unicodedata
+import time
+import queue
+import secrets
+import tempfile
+import asyncio
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+)
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
+    InlineQueryHandler,
     ConversationHandler,
     filters,
     ContextTypes,
-    PicklePersistence,
+    BasePersistence,
+    BaseUpdateProcessor,
+    PersistenceInput,
 )
 
-# 🔧 إعدادات المسار للقرص الدائم على Render
-DISK_PATH = "/home/render/data"
-os.makedirs(DISK_PATH, exist_ok=True)  # تأكد من وجود المجلد
-
-# 📁 مسارات الملفات على القرص الدائم
-DB_PATH = os.path.join(DISK_PATH, "bot_database.db")
-PERSISTENCE_PATH = os.path.join(DISK_PATH, "conversation_data.pickle")
-
-# 🔄 إذا كنت تستخدم PicklePersistence، عدل السطر ليصبح:
-persistence = PicklePersistence(filepath=PERSISTENCE_PATH)
-
-# 🔌 إذا كان لديك اتصال بقاعدة البيانات، استخدم المسار الجديد
-def init_database():
-    """تهيئة قاعدة البيانات على المسار الدائم"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # أنشئ الجداول التي تحتاجها هنا
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            username TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # أضف الجداول الأخرى التي تحتاجها
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            amount REAL,
-            description TEXT,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-# 🚀 استدعاء تهيئة قاعدة البيانات عند البدء
-init_database()
-
-# ⚙️ إعدادات البوت (احتفظ بإعداداتك الحالية)
-TOKEN = os.getenv('BOT_TOKEN')  # تأكد أن التوكن في environment variables
-ADMIN_USER = os.getenv('ADMIN_USER')
-ADMIN_PASS = os.getenv('ADMIN_PASS')
-
-# 📝 تأكد من أن التوكن موجود
-if not TOKEN:
-    logging.error("لم يتم العثور على التوكن! تأكد من إعداد environment variables.")
-    exit(1)
-
-# 🔄 إذا كنت تستخدم ApplicationBuilder، عدله ليستخدم المسار الدائم
-def main():
-    # استخدم persistence الجديدة إذا كنت تحتاجها
-    application = Application.builder().token(TOKEN).persistence(persistence).build()
-    
-    # أو بدون persistence إذا لم تكن تستخدمها
-    # application = Application.builder().token(TOKEN).build()
-    
-    # أضف handlers الخاص بك هنا (احتفظ بالأكواد الحالية)
-    # ... handlers الحالية ...
-    
-
 # =========================
 # Configuration
 # =========================
@@ -93,11 +54,89 @@ TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_USER = "Osman"
 ADMIN_PASS = "2580"
 
+# مجلد التخزين الدائم (على Render مثلاً: /home/render/data)
+DATA_DIR = os.getenv("DATA_DIR", ".")
+
 # قاعدة البيانات الموحدة
-DATABASE_FILE = "community_database.db"
+DATABASE_FILE = os.getenv("DATABASE_FILE", os.path.join(DATA_DIR, "community_database.db"))
 
 # مجلد ملفات CSV المؤقتة
-TEMP_CSV_DIR = "temp_csv"
+TEMP_CSV_DIR = os.getenv("TEMP_CSV_DIR", os.path.join(DATA_DIR, "temp_csv"))
+
+# طريقة استقبال التحديثات: polling أو webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+
+# إعدادات webhook: العنوان العام، عنوان ومنفذ الاستماع، المسار، والرمز السري للتحقق من الطلبات
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# معالجة التحديثات بالتوازي: الحد الأقصى للمعالجات العاملة معاً، والحد الأقصى للتحديثات المنتظرة
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "256"))
+
+# عدد نتائج البحث عن الأعضاء في كل صفحة
+MEMBER_SEARCH_PAGE_SIZE = int(os.getenv("MEMBER_SEARCH_PAGE_SIZE", "10"))
+
+# عدد الجولات المعروضة في قائمة جولات التوزيع واختيار جولة للتصدير
+CAMPAIGNS_LIST_LIMIT = int(os.getenv("CAMPAIGNS_LIST_LIMIT", "10"))
+
+# الحد الأقصى لعدد الجوازات في دفعة تسليم واحدة، وعدد الأسماء المعروضة لكل مجموعة في ملخصها
+BATCH_DELIVERY_MAX_SIZE = int(os.getenv("BATCH_DELIVERY_MAX_SIZE", "500"))
+BATCH_DELIVERY_PREVIEW_SIZE = int(os.getenv("BATCH_DELIVERY_PREVIEW_SIZE", "15"))
+# الحد الأقصى لحجم ملف CSV لدفعة التسليم بالبايت
+BATCH_DELIVERY_MAX_FILE_SIZE = int(os.getenv("BATCH_DELIVERY_MAX_FILE_SIZE", str(256 * 1024)))
+
+# عدد الصفوف في كل دفعة (ومعاملة) عند استيراد ملفات CSV
+CSV_IMPORT_CHUNK_SIZE = int(os.getenv("CSV_IMPORT_CHUNK_SIZE", "1000"))
+
+# تصدير CSV: عدد الصفوف المقروءة في كل دفعة، والحجم الذي ينتقل بعده الملف المؤقت من الذاكرة إلى القرص
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+EXPORT_SPOOL_MAX_SIZE = int(os.getenv("EXPORT_SPOOL_MAX_SIZE", str(1024 * 1024)))
+
+# مجمع اتصالات قاعدة البيانات
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+# عدد خيوط المنفذ المخصص لعمليات قاعدة البيانات
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_SIZE)))
+
+# إعدادات تخزين SQLite المطبقة على كل اتصال
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "8192")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+    "journal_size_limit": int(os.getenv("SQLITE_JOURNAL_SIZE_LIMIT", str(32 * 1024 * 1024))),
+}
+
+# الفاصل الزمني (بالثواني) لمهمة تفريغ WAL وتحسين قاعدة البيانات
+DB_MAINTENANCE_INTERVAL = int(os.getenv("DB_MAINTENANCE_INTERVAL", "900"))
+
+# ذاكرة مؤقتة لبيانات الأعضاء: عدد السجلات، ومدة صلاحية السجل ونتيجة "غير مسجل" بالثواني
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "5000"))
+MEMBER_CACHE_TTL = float(os.getenv("MEMBER_CACHE_TTL", "600"))
+MEMBER_CACHE_NEGATIVE_TTL = float(os.getenv("MEMBER_CACHE_NEGATIVE_TTL", "60"))
+
+# مدة صلاحية جلسة دخول الأدمن والمشرفين بالثواني
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(12 * 60 * 60)))
+
+# البحث المضمن (@bot رقم الجواز أو الاسم): عدد النتائج، ومدة تخزينها بالثواني داخل البوت فقط
+INLINE_RESULTS_LIMIT = int(os.getenv("INLINE_RESULTS_LIMIT", "10"))
+INLINE_CACHE_TTL = int(os.getenv("INLINE_CACHE_TTL", "30"))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "1000"))
+
+# البث الجماعي: معدل الإرسال في الثانية، عدد الإرسالات المتزامنة، حجم الدفعة، وعدد المحاولات
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "200"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "10"))
 
 # =========================
 # States using Enum
@@ -165,6 +204,18 @@ class States(Enum):
     
     # Broadcast
     BROADCAST_MESSAGE = auto()
+    
+    # Member search
+    SEARCH_MEMBERS = auto()
+    
+    # Delivery campaigns
+    MANAGE_CAMPAIGNS = auto()
+    OPEN_CAMPAIGN_NAME = auto()
+    SELECT_CAMPAIGN_FOR_EXPORT = auto()
+    
+    # Batch delivery
+    BATCH_DELIVERY_INPUT = auto()
+    CONFIRM_BATCH_DELIVERY = auto()
 
 # =========================
 # Logging
@@ -176,86 +227,824 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# =========================
+# Passport keys
+# =========================
+
+# الأرقام الهندية (العربية) والفارسية إلى أرقام لاتينية
+_PASSPORT_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+
+def normalize_passport(passport: str) -> str:
+    """المفتاح الموحد لرقم الجواز: أحرف كبيرة، أرقام لاتينية، بدون مسافات أو فواصل"""
+    text = unicodedata.normalize("NFKC", passport or "").translate(_PASSPORT_DIGITS)
+    key = "".join(
+        char for char in text
+        if unicodedata.category(char)[0] not in ("P", "Z", "C")
+    ).upper()
+    # رقم مكون من فواصل فقط يبقى كما هو حتى لا تتطابق كل هذه الأرقام مع مفتاح فارغ
+    return key or (passport or "").strip()
+
 # =========================
 # Database initialization and helper functions
 # =========================
 
+class ConnectionPool:
+    """مجمع محدود من اتصالات SQLite طويلة العمر يعاد استخدامها بين الاستدعاءات"""
+
+    def __init__(self, database: str, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT,
+                 cached_statements: int = DB_STATEMENT_CACHE_SIZE, pragmas: Optional[Dict] = None):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """فتح اتصال جديد مع ذاكرة للعبارات المجهزة وإعدادات التخزين"""
+        conn = sqlite3.connect(
+            self.database,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.create_function("normalize_passport", 1, normalize_passport, deterministic=True)
+        try:
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+        except sqlite3.Error:
+            conn.close()
+            raise
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        """إغلاق اتصال تالف وإخراجه من المجمع"""
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self) -> sqlite3.Connection:
+        """حجز اتصال من المجمع، أو فتح اتصال جديد إذا لم يصل المجمع لحده الأقصى"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection available after {self.timeout}s")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        """إعادة الاتصال إلى المجمع بعد التراجع عن أي معاملة مفتوحة"""
+        try:
+            if not discard and conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        if discard or self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """اتصال كمدير سياق: يحفظ عند النجاح ويتراجع ويعيد الاتصال دائماً عند الخطأ"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard)
+
+    def close(self):
+        """إغلاق جميع الاتصالات"""
+        self._closed = True
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+_db_pool: Optional[ConnectionPool] = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool() -> ConnectionPool:
+    """الحصول على مجمع الاتصالات المشترك وإنشاؤه عند أول استخدام"""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(DATABASE_FILE)
+    return _db_pool
+
+def close_db_pool():
+    """إغلاق مجمع الاتصالات المشترك"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.close()
+            _db_pool = None
+
+def get_db_connection():
+    """الحصول على اتصال من المجمع (يستخدم مع with ويعاد للمجمع حتى عند الخطأ)"""
+    return get_db_pool().connection()
+
+def chunked(rows: Iterable, size: int) -> Iterator[List]:
+    """تقسيم الصفوف إلى دفعات بحجم محدد دون تحميلها كلها في الذاكرة"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def run_db_maintenance() -> Tuple[int, int, int]:
+    """تفريغ ملف WAL داخل قاعدة البيانات وتحديث إحصائيات المخطط"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        busy, log_frames, checkpointed = cursor.fetchone()
+        cursor.execute("PRAGMA optimize")
+    return busy, log_frames, checkpointed
+
 def init_database():
-    """تهيئة قاعدة البيانات مع جميع الجداول"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    """تهيئة قاعدة البيانات مع جميع الجداول، ولا شيء يُنفذ إذا كان المخطط محدثاً"""
+    with get_db_connection() as conn:
+        if is_schema_current(conn):
+            logger.info(f"Database schema is up to date (version {SCHEMA_VERSION})")
+            return
+        
+        cursor = conn.cursor()
+    
+        # جدول الأعضاء
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS members (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                passport TEXT UNIQUE NOT NULL,
+                phone TEXT,
+                address TEXT,
+                role TEXT,
+                family_members INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+        # جدول المستخدمين
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER UNIQUE NOT NULL,
+                username TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+        # جدول المشرفين
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS assistants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+        # جدول التسليمات
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                supervisor TEXT NOT NULL,
+                passport TEXT NOT NULL,
+                member_name TEXT NOT NULL,
+                delivery_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+        # جدول الخدمات
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS services (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+        # جدول طلبات الخدمات
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS service_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                passport TEXT NOT NULL,
+                service_name TEXT NOT NULL,
+                request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                requester TEXT NOT NULL
+            )
+        """)
     
-    # جدول الأعضاء
+        # تطبيق خطوات الترحيل المعلقة
+        run_migrations(conn)
+
+# =========================
+# Schema migrations
+# =========================
+
+def _migration_001_hot_path_indexes(cursor: sqlite3.Cursor):
+    """فهارس مسارات البحث والفرز الأكثر استخداماً"""
+    # آخر تسليم لرقم جواز (check_existing_delivery)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_passport ON deliveries(passport)")
+    # تسليمات المشرف وملخصها حسب التاريخ (get_deliveries_by_supervisor)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_supervisor_date ON deliveries(supervisor, delivery_date)")
+    # التحقق من طلب خدمة مسبق
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_service_requests_passport_service ON service_requests(passport, service_name)")
+    # كشوفات وإحصائيات الخدمات (get_service_statistics)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_service_requests_service ON service_requests(service_name)")
+    # ترتيب الأعضاء حسب تاريخ التسجيل
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_created_at ON members(created_at)")
+    # ملخص المسجلين حسب الصفة مع مجموع أفراد الأسر
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_role_family ON members(role, family_members)")
+
+# العدادات المحدثة بواسطة المشغلات: (اسم العداد، الجدول، مقدار الزيادة لكل صف)
+STATS_COUNTERS = [
+    ("members", "members", "1"),
+    ("family_members", "members", "COALESCE({row}.family_members, 0)"),
+    ("deliveries", "deliveries", "1"),
+    ("users", "users", "1"),
+    ("assistants", "assistants", "1"),
+    ("service_requests", "service_requests", "1"),
+]
+
+def _migration_002_stats_counters(cursor: sqlite3.Cursor):
+    """جدول عدادات الإحصائيات مع مشغلات تحدثه عند الإضافة والحذف"""
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS members (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            passport TEXT UNIQUE NOT NULL,
-            phone TEXT,
-            address TEXT,
-            role TEXT,
-            family_members INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
         )
     """)
     
-    # جدول المستخدمين
+    for name, table, delta in STATS_COUNTERS:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO stats_counters (name, value) "
+            f"SELECT ?, COALESCE(SUM({delta.format(row=table)}), 0) FROM {table}",
+            (name,)
+        )
+    
+    tables = sorted({table for _, table, _ in STATS_COUNTERS})
+    for table in tables:
+        counters = [(name, delta) for name, t, delta in STATS_COUNTERS if t == table]
+        on_insert = "".join(
+            f"UPDATE stats_counters SET value = value + {delta.format(row='NEW')} WHERE name = '{name}'; "
+            for name, delta in counters
+        )
+        on_delete = "".join(
+            f"UPDATE stats_counters SET value = value - {delta.format(row='OLD')} WHERE name = '{name}'; "
+            for name, delta in counters
+        )
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table} BEGIN {on_insert}END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table} BEGIN {on_delete}END")
+    
+    # تحديث مجموع أفراد الأسر عند تعديل بيانات عضو
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_members_family_update
+        AFTER UPDATE OF family_members ON members
+        BEGIN
+            UPDATE stats_counters
+            SET value = value + COALESCE(NEW.family_members, 0) - COALESCE(OLD.family_members, 0)
+            WHERE name = 'family_members';
+        END
+    """)
+
+def _migration_003_broadcast_jobs(cursor: sqlite3.Cursor):
+    """جدول مهام البث الجماعي مع مؤشر الاستئناف"""
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL,
-            username TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            message TEXT NOT NULL,
+            admin_chat_id INTEGER NOT NULL,
+            progress_message_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_row_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
         )
     """)
-    
-    # جدول المشرفين
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status)")
+
+def _migration_004_sessions(cursor: sqlite3.Cursor):
+    """جلسات الدخول بالرموز بدلاً من حفظ كلمة المرور في بيانات المستخدم"""
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS assistants (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
+        CREATE TABLE IF NOT EXISTS sessions (
+            token TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            user_type TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            revoked INTEGER NOT NULL DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_username ON sessions(username)")
+
+def _migration_005_persistence(cursor: sqlite3.Cursor):
+    """تخزين بيانات المستخدمين وحالات المحادثات لكل مفتاح على حدة"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS persistence_data (
+            kind TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (kind, id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS persistence_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state BLOB NOT NULL,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+    """)
+
+def _migration_006_passport_keys(cursor: sqlite3.Cursor):
+    """عمود passport_key الموحد مع فهارسه، ودمج الأعضاء المكررين بنفس المفتاح"""
+    for table in ("members", "deliveries", "service_requests"):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN passport_key TEXT")
+        cursor.execute(f"UPDATE {table} SET passport_key = normalize_passport(passport)")
     
-    # جدول التسليمات
+    # "P 123" و"p123" كانا يسجلان كعضوين؛ يبقى أقدم تسجيل في members وتحفظ البقية كاملة
+    # في members_passport_conflicts لمراجعتها من الأدمن قبل إنشاء الفهرس الفريد
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS deliveries (
+        CREATE TABLE IF NOT EXISTS members_passport_conflicts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            supervisor TEXT NOT NULL,
-            passport TEXT NOT NULL,
-            member_name TEXT NOT NULL,
-            delivery_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            member_id INTEGER NOT NULL,
+            kept_member_id INTEGER NOT NULL,
+            name TEXT,
+            passport TEXT,
+            passport_key TEXT,
+            phone TEXT,
+            address TEXT,
+            role TEXT,
+            family_members INTEGER,
+            created_at TIMESTAMP,
+            detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            exported_at TIMESTAMP
         )
     """)
-    
-    # جدول الخدمات
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS services (
+        INSERT INTO members_passport_conflicts
+            (member_id, kept_member_id, name, passport, passport_key, phone, address, role, family_members, created_at)
+        SELECT m.id, k.kept_id, m.name, m.passport, m.passport_key, m.phone, m.address, m.role,
+               m.family_members, m.created_at
+        FROM members m
+        JOIN (SELECT passport_key, MIN(id) AS kept_id FROM members GROUP BY passport_key) k
+          ON k.passport_key = m.passport_key
+        WHERE m.id <> k.kept_id
+        ORDER BY m.id
+    """)
+    if cursor.rowcount:
+        logger.warning(f"Moved {cursor.rowcount} member registrations with a duplicate passport key "
+                       f"to members_passport_conflicts")
+    cursor.execute("DELETE FROM members WHERE id IN (SELECT member_id FROM members_passport_conflicts)")
+    
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_members_passport_key ON members(passport_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_passport_key ON deliveries(passport_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_service_requests_passport_key_service ON service_requests(passport_key, service_name)")
+    # البحث أصبح بالمفتاح الموحد، فلا حاجة لفهارس رقم الجواز كما كُتب
+    cursor.execute("DROP INDEX IF EXISTS idx_deliveries_passport")
+    cursor.execute("DROP INDEX IF EXISTS idx_service_requests_passport_service")
+
+def _migration_007_members_fts(cursor: sqlite3.Cursor):
+    """فهرس FTS5 للبحث في الاسم والهاتف والعنوان والصفة، محدث بواسطة المشغلات"""
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS members_fts USING fts5(
+            name, phone, address, role,
+            content='members', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_members_fts_insert AFTER INSERT ON members BEGIN
+            INSERT INTO members_fts (rowid, name, phone, address, role)
+            VALUES (new.id, new.name, new.phone, new.address, new.role);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_members_fts_delete AFTER DELETE ON members BEGIN
+            INSERT INTO members_fts (members_fts, rowid, name, phone, address, role)
+            VALUES ('delete', old.id, old.name, old.phone, old.address, old.role);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_members_fts_update AFTER UPDATE OF name, phone, address, role ON members BEGIN
+            INSERT INTO members_fts (members_fts, rowid, name, phone, address, role)
+            VALUES ('delete', old.id, old.name, old.phone, old.address, old.role);
+            INSERT INTO members_fts (rowid, name, phone, address, role)
+            VALUES (new.id, new.name, new.phone, new.address, new.role);
+        END
+    """)
+    # فهرسة الأعضاء المسجلين مسبقاً
+    cursor.execute("INSERT INTO members_fts (members_fts) VALUES ('rebuild')")
+
+def _migration_008_unique_service_requests(cursor: sqlite3.Cursor):
+    """طلب واحد فقط لكل عضو في كل خدمة، مع حذف الطلبات المكررة (يبقى أقدمها)"""
+    cursor.execute("""
+        DELETE FROM service_requests
+        WHERE id NOT IN (SELECT MIN(id) FROM service_requests GROUP BY passport_key, service_name)
+    """)
+    if cursor.rowcount:
+        logger.warning(f"Removed {cursor.rowcount} duplicate service requests")
+    cursor.execute("DROP INDEX IF EXISTS idx_service_requests_passport_key_service")
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_service_requests_passport_key_service
+        ON service_requests(passport_key, service_name)
+    """)
+
+def _migration_009_delivery_campaigns(cursor: sqlite3.Cursor):
+    """جولات التوزيع: كل تسليم ينتمي لجولة، وجولة واحدة على الأكثر مفتوحة في أي وقت"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS campaigns (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            name TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'closed')),
+            opened_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            closed_at TIMESTAMP
         )
     """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_campaigns_open ON campaigns(status) WHERE status = 'open'")
+    cursor.execute("ALTER TABLE deliveries ADD COLUMN campaign_id INTEGER REFERENCES campaigns(id)")
+    
+    # التسليمات السابقة تصبح الجولة الأولى المفتوحة، فلا يتغير سلوك التحذير من التكرار حتى يفتح الأدمن جولة جديدة
+    cursor.execute("INSERT INTO campaigns (name) VALUES ('الجولة الأولى')")
+    cursor.execute("UPDATE deliveries SET campaign_id = ?", (cursor.lastrowid,))
     
-    # جدول طلبات الخدمات
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_campaign_passport_key ON deliveries(campaign_id, passport_key)")
+    # فحص التكرار أصبح داخل الجولة، والفهرس المركب يغطيه
+    cursor.execute("DROP INDEX IF EXISTS idx_deliveries_passport_key")
+
+def _migration_010_latest_delivery_index(cursor: sqlite3.Cursor):
+    """فهرس آخر تسليم للعضو في الجولة: فحص التكرار يصل لأحدث صف مباشرة ثم يقرأه من الجدول بمعرفه"""
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS service_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            passport TEXT NOT NULL,
-            service_name TEXT NOT NULL,
-            request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            requester TEXT NOT NULL
+        CREATE INDEX IF NOT EXISTS idx_deliveries_campaign_latest
+        ON deliveries(campaign_id, passport_key, id DESC)
+    """)
+    # الفهرس الجديد يبدأ بنفس الأعمدة فيغني عن السابق
+    cursor.execute("DROP INDEX IF EXISTS idx_deliveries_campaign_passport_key")
+
+# خطوات الترحيل مرتبة حسب رقم الإصدار، ولا تعدل خطوة بعد نشرها بل تضاف خطوة جديدة
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "hot-path indexes", _migration_001_hot_path_indexes),
+    (2, "trigger-maintained stats counters", _migration_002_stats_counters),
+    (3, "resumable broadcast jobs", _migration_003_broadcast_jobs),
+    (4, "token sessions", _migration_004_sessions),
+    (5, "per-key bot persistence", _migration_005_persistence),
+    (6, "normalised passport keys", _migration_006_passport_keys),
+    (7, "full-text member search", _migration_007_members_fts),
+    (8, "unique service request per member", _migration_008_unique_service_requests),
+    (9, "delivery campaigns", _migration_009_delivery_campaigns),
+    (10, "latest-delivery index", _migration_010_latest_delivery_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """الحصول على آخر إصدار مطبق للمخطط"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def is_schema_current(conn: sqlite3.Connection) -> bool:
+    """التحقق (بقراءة فقط) من أن جميع خطوات الترحيل مطبقة"""
+    try:
+        cursor = conn.execute("SELECT MAX(version) FROM schema_version")
+    except sqlite3.OperationalError:
+        return False
+    return cursor.fetchone()[0] == SCHEMA_VERSION
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """تطبيق خطوات الترحيل غير المطبقة بالترتيب، كل خطوة في معاملة مستقلة"""
+    current_version = get_schema_version(conn)
+    
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            migrate(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f"Schema migration {version} ({description}) failed")
+            raise
+        
+        logger.info(f"Applied schema migration {version}: {description}")
+        current_version = version
     
-    conn.commit()
-    conn.close()
+    return current_version
 
-def get_db_connection():
-    """الحصول على اتصال بقاعدة البيانات"""
-    return sqlite3.connect(DATABASE_FILE)
+# =========================
+# CSV validation pipeline
+# =========================
+
+class CsvValidationReport:
+    """عدادات التحقق من ملف CSV مع عينة محدودة من الأخطاء بدلاً من الاحتفاظ بالصفوف"""
+
+    def __init__(self, max_error_samples: int = 5):
+        self.max_error_samples = max_error_samples
+        self.total_rows = 0
+        self.valid_rows = 0
+        self.error_count = 0
+        self.error_samples: List[str] = []
+        self.missing_columns: List[str] = []
+        self.read_error: Optional[str] = None
+
+    def add_error(self, message: str):
+        self.error_count += 1
+        if len(self.error_samples) < self.max_error_samples:
+            self.error_samples.append(message)
+
+    def result(self) -> Tuple[bool, str]:
+        """نتيجة التحقق ورسالتها للمستخدم"""
+        if self.read_error:
+            return False, f"❌ خطأ في قراءة الملف: {self.read_error}"
+        if self.missing_columns:
+            return False, f"❌ الأعمدة التالية مفقودة: {', '.join(self.missing_columns)}"
+        if not self.total_rows:
+            return False, "❌ الملف فارغ أو لا يحتوي على بيانات"
+        if self.error_count:
+            error_msg = "\n".join(self.error_samples)
+            if self.error_count > len(self.error_samples):
+                error_msg += f"\n... وغيرها {self.error_count - len(self.error_samples)} خطأ"
+            return False, f"❌ وجدت الأخطاء التالية:\n{error_msg}"
+        return True, f"✅ الملف صالح. عدد السجلات: {self.valid_rows}"
+
+def iter_csv_rows(file_path: str, required_columns: List[str], parse_row: Callable[[Dict], Dict],
+                  report: Optional[CsvValidationReport] = None) -> Iterator[Dict]:
+    """قراءة ملف CSV صفاً بصف وإرجاع الصفوف الصالحة بعد تحويلها، مع تسجيل الأخطاء في التقرير"""
+    report = report if report is not None else CsvValidationReport()
+    try:
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None:
+                return
+            
+            report.missing_columns = [col for col in required_columns if col not in reader.fieldnames]
+            if report.missing_columns:
+                return
+            
+            for i, row in enumerate(reader, 1):
+                report.total_rows += 1
+                try:
+                    parsed = parse_row(row)
+                except ValueError as e:
+                    report.add_error(f"الصف {i}: {e}")
+                    continue
+                report.valid_rows += 1
+                yield parsed
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        report.read_error = str(e)
+
+def validate_csv_file(rows: Iterator[Dict], report: CsvValidationReport) -> Tuple[bool, str, int]:
+    """تمرير كامل على الملف للتحقق دون الاحتفاظ بالصفوف"""
+    for _ in rows:
+        pass
+    is_valid, message = report.result()
+    return is_valid, message, report.valid_rows
+
+class ImportAborted(Exception):
+    """خطأ يوقف الاستيراد كله بدلاً من إعادة محاولة الصفوف واحداً واحداً"""
+
+def import_csv_chunks(rows: Iterable[Dict], chunk_size: int,
+                      import_chunk: Callable[[sqlite3.Connection, List[Dict]], Tuple[int, ...]],
+                      initial: Tuple[int, ...], label: str,
+                      after_chunk: Optional[Callable[[], None]] = None) -> Tuple[Tuple[int, ...], List[str]]:
+    """استيراد الصفوف على دفعات، كل دفعة في معاملة مستقلة، وإرجاع مجموع العدادات والأخطاء.
+    
+    إذا فشلت دفعة يعاد استيراد صفوفها واحداً واحداً، فتحفظ الصفوف السليمة ويذكر رقم كل صف فاشل.
+    """
+    totals = initial
+    errors = []
+    first_row = 1
+    
+    def add(counts: Tuple[int, ...]):
+        nonlocal totals
+        totals = tuple(total + count for total, count in zip(totals, counts))
+    
+    for chunk in chunked(rows, chunk_size):
+        try:
+            try:
+                with get_db_connection() as conn:
+                    counts = import_chunk(conn, chunk)
+                add(counts)
+            except ImportAborted:
+                raise
+            except Exception as e:
+                logger.warning(f"Importing {label} rows {first_row}-{first_row + len(chunk) - 1} failed ({e}), "
+                               f"retrying row by row")
+                for row_number, row in enumerate(chunk, first_row):
+                    try:
+                        with get_db_connection() as conn:
+                            counts = import_chunk(conn, [row])
+                        add(counts)
+                    except ImportAborted:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error importing {label} row {row_number}: {e}")
+                        errors.append(f"الصف {row_number}: {str(e)}")
+        except ImportAborted as e:
+            logger.error(f"Importing {label} aborted at rows from {first_row}: {e}")
+            errors.append(str(e))
+            break
+        finally:
+            if after_chunk is not None:
+                after_chunk()
+        first_row += len(chunk)
+    
+    return totals, errors
+
+# =========================
+# CSV export engine
+# =========================
+
+def write_csv_export(header: List[str], batches: Iterable[Sequence[Sequence]]) -> IO[bytes]:
+    """كتابة دفعات من الصفوف إلى ملف CSV مؤقت خاص بالطلب ثم إرجاعه من بدايته"""
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE, mode="w+b")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    def flush():
+        output.write(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+    
+    try:
+        writer.writerow(header)
+        flush()
+        for batch in batches:
+            writer.writerows(batch)
+            flush()
+    except BaseException:
+        output.close()
+        raise
+    
+    output.seek(0)
+    return output
+
+def export_query_to_csv(header: List[str], query: str, params: Tuple = ()) -> IO[bytes]:
+    """تصدير نتيجة استعلام إلى CSV بقراءة المؤشر على دفعات"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return write_csv_export(header, iter(lambda: cursor.fetchmany(EXPORT_FETCH_SIZE), []))
+
+# =========================
+# Member cache
+# =========================
+
+class MemberCache:
+    """ذاكرة LRU لسجلات الأعضاء حسب رقم الجواز، مع تخزين نتائج "غير مسجل" لمدة أقصر"""
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # يزداد مع كل إبطال حتى لا تُخزن نتيجة قراءة سبقت الكتابة
+        self._generation = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, passport: str):
+        """إرجاع السجل (أو None للجواز غير المسجل)، أو _MISSING إذا لم يكن مخزناً"""
+        with self._lock:
+            entry = self._entries.get(passport)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[passport]
+                self.misses += 1
+                return self._MISSING
+            self._entries.move_to_end(passport)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+    def put(self, passport: str, member: Optional[Dict], generation: int):
+        """تخزين نتيجة القراءة ما لم يحدث إبطال منذ بدايتها"""
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if member is not None else self.negative_ttl
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[passport] = (time.monotonic() + ttl, member)
+            self._entries.move_to_end(passport)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, passport: str):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(passport, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+            }
+
+member_cache = MemberCache(MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL, MEMBER_CACHE_NEGATIVE_TTL)
+
+class TTLCache:
+    """ذاكرة LRU صغيرة بمدة صلاحية ثابتة لنتائج البحث المتكررة"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+inline_lookup_cache = TTLCache(INLINE_CACHE_SIZE, INLINE_CACHE_TTL)
 
 # =========================
 # Members functions
@@ -263,41 +1052,49 @@ def get_db_connection():
 
 def add_member(name: str, passport: str, phone: str, address: str, role: str, family_members: int) -> bool:
     """إضافة عضو جديد"""
+    passport_key = normalize_passport(passport)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO members (name, passport, phone, address, role, family_members)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (name, passport, phone, address, role, family_members))
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO members (name, passport, passport_key, phone, address, role, family_members)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (name, passport, passport_key, phone, address, role, family_members))
         return True
     except sqlite3.IntegrityError:
         return False
     except Exception as e:
         logger.error(f"Error adding member: {e}")
         return False
+    finally:
+        member_cache.invalidate(passport_key)
+        inline_lookup_cache.clear()
 
 def is_passport_registered(passport: str) -> bool:
     """التحقق من تسجيل رقم الجواز"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM members WHERE passport = ?", (passport,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count > 0
+    return get_member_by_passport(passport) is not None
 
 def get_member_by_passport(passport: str) -> Optional[Dict]:
-    """الحصول على بيانات العضو بواسطة رقم الجواز"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, name, passport, phone, address, role, family_members, created_at
-        FROM members WHERE passport = ?
-    """, (passport,))
-    row = cursor.fetchone()
-    conn.close()
+    """الحصول على بيانات العضو بواسطة رقم الجواز (عبر ذاكرة الأعضاء المؤقتة)"""
+    passport_key = normalize_passport(passport)
+    cached = member_cache.get(passport_key)
+    if cached is not MemberCache._MISSING:
+        return dict(cached) if cached is not None else None
+    
+    generation = member_cache.generation
+    member = _fetch_member_by_passport_key(passport_key)
+    member_cache.put(passport_key, member, generation)
+    return dict(member) if member is not None else None
+
+def _fetch_member_by_passport_key(passport_key: str) -> Optional[Dict]:
+    """قراءة بيانات العضو من قاعدة البيانات مباشرة"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, name, passport, phone, address, role, family_members, created_at
+            FROM members WHERE passport_key = ?
+        """, (passport_key,))
+        row = cursor.fetchone()
     
     if row:
         return {
@@ -314,14 +1111,13 @@ def get_member_by_passport(passport: str) -> Optional[Dict]:
 
 def get_all_members() -> List[Dict]:
     """الحصول على جميع الأعضاء"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, name, passport, phone, address, role, family_members, created_at
-        FROM members ORDER BY id
-    """)
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, name, passport, phone, address, role, family_members, created_at
+            FROM members ORDER BY id
+        """)
+        rows = cursor.fetchall()
     
     return [{
         "id": row[0],
@@ -337,177 +1133,262 @@ def get_all_members() -> List[Dict]:
 def delete_all_members() -> bool:
     """حذف جميع الأعضاء"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM members")
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM members")
         return True
     except Exception as e:
         logger.error(f"Error deleting all members: {e}")
         return False
+    finally:
+        member_cache.clear()
+        inline_lookup_cache.clear()
 
-def export_members_to_csv() -> str:
-    """تصدير بيانات الأعضاء إلى CSV"""
-    os.makedirs(TEMP_CSV_DIR, exist_ok=True)
-    filename = os.path.join(TEMP_CSV_DIR, "members_export.csv")
-    
-    members = get_all_members()
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["الاسم", "الجواز", "الهاتف", "العنوان", "الصفة", "عدد_افراد_الاسرة", "تاريخ_التسجيل"])
-        for member in members:
-            writer.writerow([
-                member["name"], member["passport"], member["phone"],
-                member["address"], member["role"], member["family_members"],
-                member["created_at"]
-            ])
-    
-    return filename
-
-def validate_members_csv(file_path: str) -> Tuple[bool, str, List[Dict]]:
-    """التحقق من صحة ملف CSV للأعضاء"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-        
-        if not rows:
-            return False, "❌ الملف فارغ أو لا يحتوي على بيانات", []
-        
-        required_columns = ["الاسم", "الجواز", "الهاتف", "العنوان", "الصفة", "عدد_افراد_الاسرة"]
-        missing_columns = [col for col in required_columns if col not in rows[0].keys()]
-        
-        if missing_columns:
-            return False, f"❌ الأعمدة التالية مفقودة: {', '.join(missing_columns)}", []
-        
-        valid_rows = []
-        errors = []
-        
-        for i, row in enumerate(rows, 1):
-            if not row.get("الاسم") or not row.get("الجواز"):
-                errors.append(f"الصف {i}: الاسم ورقم الجواز مطلوبان")
-                continue
-            
-            try:
-                family_count = int(row.get("عدد_افراد_الاسرة", "1"))
-                if family_count < 1:
-                    errors.append(f"الصف {i}: عدد أفراد الأسرة يجب أن يكون أكثر من صفر")
-                    continue
-            except ValueError:
-                errors.append(f"الصف {i}: عدد أفراد الأسرة يجب أن يكون رقماً صحيحاً")
-                continue
-            
-            valid_rows.append({
-                "name": row["الاسم"],
-                "passport": row["الجواز"],
-                "phone": row.get("الهاتف", ""),
-                "address": row.get("العنوان", ""),
-                "role": row.get("الصفة", ""),
-                "family_members": family_count
-            })
-        
-        if errors and len(errors) > 5:
-            error_msg = "\n".join(errors[:5]) + f"\n... وغيرها {len(errors) - 5} خطأ"
-        elif errors:
-            error_msg = "\n".join(errors)
+def count_member_conflicts(unreported_only: bool = False) -> int:
+    """عدد التسجيلات المتعارضة (نفس مفتاح الجواز)، أو التي لم يحملها الأدمن بعد فقط"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if unreported_only:
+            cursor.execute("SELECT COUNT(*) FROM members_passport_conflicts WHERE exported_at IS NULL")
         else:
-            error_msg = ""
-        
-        if errors:
-            return False, f"❌ وجدت الأخطاء التالية:\n{error_msg}", valid_rows
-        
-        return True, f"✅ الملف صالح. عدد السجلات: {len(valid_rows)}", valid_rows
-        
-    except Exception as e:
-        return False, f"❌ خطأ في قراءة الملف: {str(e)}", []
-
-def import_members_from_csv(csv_data: List[Dict]) -> Tuple[int, int, List]:
-    """استيراد بيانات الأعضاء من CSV"""
-    added_count = 0
-    updated_count = 0
-    errors = []
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    for i, row in enumerate(csv_data, 1):
-        try:
-            passport = row["passport"]
-            
-            # البحث عن العضو الموجود
-            cursor.execute("SELECT id FROM members WHERE passport = ?", (passport,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # تحديث العضو الموجود
-                cursor.execute("""
-                    UPDATE members SET name = ?, phone = ?, address = ?, role = ?, family_members = ?
-                    WHERE passport = ?
-                """, (row["name"], row["phone"], row["address"], row["role"], row["family_members"], passport))
-                updated_count += 1
-            else:
-                # إضافة عضو جديد
-                cursor.execute("""
-                    INSERT INTO members (name, passport, phone, address, role, family_members)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (row["name"], passport, row["phone"], row["address"], row["role"], row["family_members"]))
-                added_count += 1
-                
-        except Exception as e:
-            errors.append(f"الصف {i}: {str(e)}")
-    
-    conn.commit()
-    conn.close()
-    return added_count, updated_count, errors
-
-# =========================
-# Users functions
-# =========================
+            cursor.execute("SELECT COUNT(*) FROM members_passport_conflicts")
+        return cursor.fetchone()[0]
+
+def export_member_conflicts_to_csv() -> IO[bytes]:
+    """تصدير التسجيلات المتعارضة مع العضو الذي بقي مسجلاً بنفس مفتاح الجواز"""
+    return export_query_to_csv(
+        ["الاسم", "الجواز", "الهاتف", "العنوان", "الصفة", "عدد_افراد_الاسرة", "تاريخ_التسجيل",
+         "الجواز_المسجل", "الاسم_المسجل"],
+        """
+            SELECT c.name, c.passport, c.phone, c.address, c.role, c.family_members, c.created_at,
+                   k.passport, k.name
+            FROM members_passport_conflicts c
+            LEFT JOIN members k ON k.id = c.kept_member_id
+            ORDER BY c.id
+        """
+    )
 
-def add_user_if_not_exists(user_id: int, username: str):
-    """إضافة المستخدم إذا لم يكن موجوداً"""
-    try:
-        conn = get_db_connection()
+def mark_member_conflicts_exported():
+    """تعليم التسجيلات المتعارضة كمبلغ عنها بعد إرسالها للأدمن"""
+    with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users WHERE user_id = ?", (user_id,))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, username or ""))
-            conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"Error adding user: {e}")
+        cursor.execute("""
+            UPDATE members_passport_conflicts SET exported_at = CURRENT_TIMESTAMP
+            WHERE exported_at IS NULL
+        """)
 
-def get_all_users() -> List[Dict]:
-    """الحصول على جميع المستخدمين"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, user_id, username, created_at FROM users ORDER BY id")
-    rows = cursor.fetchall()
-    conn.close()
+def _members_fts_query(text: str) -> str:
+    """تحويل نص البحث إلى استعلام FTS5: كل كلمة مطلوبة وتطابق بدايتها"""
+    text = unicodedata.normalize("NFKC", text).translate(_PASSPORT_DIGITS)
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", text))
+
+def search_members(text: str, limit: int, offset: int = 0) -> List[Dict]:
+    """البحث عن الأعضاء بالاسم أو الهاتف أو العنوان أو الصفة مرتبين حسب الصلة (bm25)"""
+    query = _members_fts_query(text)
+    if not query:
+        return []
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # الأوزان بترتيب الأعمدة: الاسم، الهاتف، العنوان، الصفة
+        cursor.execute("""
+            SELECT m.id, m.name, m.passport, m.phone, m.address, m.role, m.family_members
+            FROM members_fts
+            JOIN members m ON m.id = members_fts.rowid
+            WHERE members_fts MATCH ?
+            ORDER BY bm25(members_fts, 10.0, 5.0, 2.0, 1.0)
+            LIMIT ? OFFSET ?
+        """, (query, limit, offset))
+        rows = cursor.fetchall()
     
     return [{
         "id": row[0],
-        "user_id": row[1],
-        "username": row[2],
-        "created_at": row[3]
+        "name": row[1],
+        "passport": row[2],
+        "phone": row[3],
+        "address": row[4],
+        "role": row[5],
+        "family_members": row[6]
     } for row in rows]
 
-# =========================
-# Assistants functions
-# =========================
-
-def add_assistant(username: str, password: str) -> bool:
-    """إضافة مشرف جديد"""
-    try:
-        conn = get_db_connection()
+def find_members_by_passport_prefix(prefix: str, limit: int) -> List[Dict]:
+    """الأعضاء الذين يبدأ مفتاح جوازهم بالبادئة (مسح نطاق على فهرس passport_key)"""
+    key = normalize_passport(prefix)
+    if not key:
+        return []
+    # أصغر نص أكبر من كل المفاتيح التي تبدأ بالبادئة
+    upper = key[:-1] + chr(ord(key[-1]) + 1)
+    with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("INSERT INTO assistants (username, password) VALUES (?, ?)", (username, password))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        return False
+        cursor.execute("""
+            SELECT id, name, passport, phone, address, role, family_members
+            FROM members
+            WHERE passport_key >= ? AND passport_key < ?
+            ORDER BY passport_key
+            LIMIT ?
+        """, (key, upper, limit))
+        rows = cursor.fetchall()
+    
+    return [{
+        "id": row[0],
+        "name": row[1],
+        "passport": row[2],
+        "phone": row[3],
+        "address": row[4],
+        "role": row[5],
+        "family_members": row[6]
+    } for row in rows]
+
+def lookup_members(text: str, limit: int) -> List[Dict]:
+    """اقتراحات الأعضاء للبحث المضمن: تطابق بداية الجواز أولاً ثم البحث بالاسم"""
+    members = find_members_by_passport_prefix(text, limit)
+    if len(members) < limit:
+        seen = {member["id"] for member in members}
+        for member in search_members(text, limit):
+            if member["id"] not in seen:
+                members.append(member)
+                if len(members) == limit:
+                    break
+    return members
+
+def export_members_to_csv() -> IO[bytes]:
+    """تصدير بيانات الأعضاء إلى CSV"""
+    return export_query_to_csv(
+        ["الاسم", "الجواز", "الهاتف", "العنوان", "الصفة", "عدد_افراد_الاسرة", "تاريخ_التسجيل"],
+        """
+            SELECT name, passport, phone, address, role, family_members, created_at
+            FROM members ORDER BY id
+        """
+    )
+
+MEMBERS_CSV_COLUMNS = ["الاسم", "الجواز", "الهاتف", "العنوان", "الصفة", "عدد_افراد_الاسرة"]
+
+def _parse_member_row(row: Dict) -> Dict:
+    """تحويل صف CSV إلى بيانات عضو"""
+    if not row.get("الاسم") or not row.get("الجواز"):
+        raise ValueError("الاسم ورقم الجواز مطلوبان")
+    
+    try:
+        family_count = int(row.get("عدد_افراد_الاسرة", "1"))
+    except (TypeError, ValueError):
+        raise ValueError("عدد أفراد الأسرة يجب أن يكون رقماً صحيحاً")
+    if family_count < 1:
+        raise ValueError("عدد أفراد الأسرة يجب أن يكون أكثر من صفر")
+    
+    return {
+        "name": row["الاسم"],
+        "passport": row["الجواز"],
+        "phone": row.get("الهاتف", ""),
+        "address": row.get("العنوان", ""),
+        "role": row.get("الصفة", ""),
+        "family_members": family_count
+    }
+
+def iter_members_csv(file_path: str, report: Optional[CsvValidationReport] = None) -> Iterator[Dict]:
+    """قراءة الأعضاء الصالحين من ملف CSV تدريجياً"""
+    return iter_csv_rows(file_path, MEMBERS_CSV_COLUMNS, _parse_member_row, report)
+
+def validate_members_csv(file_path: str) -> Tuple[bool, str, int]:
+    """التحقق من صحة ملف CSV للأعضاء"""
+    report = CsvValidationReport()
+    return validate_csv_file(iter_members_csv(file_path, report), report)
+
+def _merge_members_chunk(conn: sqlite3.Connection, rows: List[Dict]) -> Tuple[int, int]:
+    """دمج دفعة من الأعضاء عبر جدول مرحلي مؤقت وإرجاع عدد المضاف والمحدث"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS members_staging (
+            seq INTEGER PRIMARY KEY,
+            name TEXT,
+            passport TEXT,
+            passport_key TEXT,
+            phone TEXT,
+            address TEXT,
+            role TEXT,
+            family_members INTEGER
+        )
+    """)
+    cursor.execute("DELETE FROM members_staging")
+    cursor.executemany("""
+        INSERT INTO members_staging (name, passport, passport_key, phone, address, role, family_members)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(row["name"], row["passport"], normalize_passport(row["passport"]), row["phone"], row["address"],
+           row["role"], row["family_members"]) for row in rows])
+    
+    # كل مفتاح جواز جديد يحسب إضافة واحدة، وباقي الصفوف تحديثات
+    cursor.execute("""
+        SELECT COUNT(DISTINCT s.passport_key) FROM members_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM members m WHERE m.passport_key = s.passport_key)
+    """)
+    added = cursor.fetchone()[0]
+    
+    # رقم الجواز المعروض يبقى كما سُجل أول مرة
+    cursor.execute("""
+        INSERT INTO members (name, passport, passport_key, phone, address, role, family_members)
+        SELECT name, passport, passport_key, phone, address, role, family_members
+        FROM members_staging WHERE true ORDER BY seq
+        ON CONFLICT(passport_key) DO UPDATE SET
+            name = excluded.name,
+            phone = excluded.phone,
+            address = excluded.address,
+            role = excluded.role,
+            family_members = excluded.family_members
+    """)
+    cursor.execute("DELETE FROM members_staging")
+    return added, len(rows) - added
+
+def _clear_member_caches():
+    member_cache.clear()
+    inline_lookup_cache.clear()
+
+def import_members_from_csv(csv_data: Iterable[Dict], chunk_size: int = CSV_IMPORT_CHUNK_SIZE) -> Tuple[int, int, List]:
+    """استيراد بيانات الأعضاء من CSV على دفعات، كل دفعة في معاملة مستقلة"""
+    (added_count, updated_count), errors = import_csv_chunks(
+        csv_data, chunk_size, _merge_members_chunk, (0, 0), "members", after_chunk=_clear_member_caches
+    )
+    return added_count, updated_count, errors
+
+# =========================
+# Users functions
+# =========================
+
+def add_user_if_not_exists(user_id: int, username: str):
+    """إضافة المستخدم إذا لم يكن موجوداً"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM users WHERE user_id = ?", (user_id,))
+            if cursor.fetchone()[0] == 0:
+                cursor.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, username or ""))
+    except Exception as e:
+        logger.error(f"Error adding user: {e}")
+
+def get_all_users() -> List[Dict]:
+    """الحصول على جميع المستخدمين"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, user_id, username, created_at FROM users ORDER BY id")
+        rows = cursor.fetchall()
+    
+    return [{
+        "id": row[0],
+        "user_id": row[1],
+        "username": row[2],
+        "created_at": row[3]
+    } for row in rows]
+
+# =========================
+# Assistants functions
+# =========================
+
+def add_assistant(username: str, password: str) -> bool:
+    """إضافة مشرف جديد"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO assistants (username, password) VALUES (?, ?)", (username, password))
+        return True
+    except sqlite3.IntegrityError:
+        return False
     except Exception as e:
         logger.error(f"Error adding assistant: {e}")
         return False
@@ -515,12 +1396,14 @@ def add_assistant(username: str, password: str) -> bool:
 def delete_assistant(username: str) -> bool:
     """حذف مشرف"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM assistants WHERE username = ?", (username,))
-        deleted = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM assistants WHERE username = ?", (username,))
+            deleted = cursor.rowcount > 0
+            if deleted:
+                _revoke_assistant_sessions(cursor, username)
+        if deleted:
+            session_store.forget_user(username, "assistant")
         return deleted
     except Exception as e:
         logger.error(f"Error deleting assistant: {e}")
@@ -529,12 +1412,14 @@ def delete_assistant(username: str) -> bool:
 def update_assistant_password(username: str, new_password: str) -> bool:
     """تحديث كلمة مرور المشرف"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE assistants SET password = ? WHERE username = ?", (new_password, username))
-        updated = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE assistants SET password = ? WHERE username = ?", (new_password, username))
+            updated = cursor.rowcount > 0
+            if updated:
+                _revoke_assistant_sessions(cursor, username)
+        if updated:
+            session_store.forget_user(username, "assistant")
         return updated
     except Exception as e:
         logger.error(f"Error updating assistant password: {e}")
@@ -542,11 +1427,10 @@ def update_assistant_password(username: str, new_password: str) -> bool:
 
 def get_all_assistants() -> List[Dict]:
     """الحصول على جميع المشرفين"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, password, created_at FROM assistants ORDER BY id")
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, username, password, created_at FROM assistants ORDER BY id")
+        rows = cursor.fetchall()
     
     return [{
         "id": row[0],
@@ -557,64 +1441,249 @@ def get_all_assistants() -> List[Dict]:
 
 def validate_assistant(username: str, password: str) -> bool:
     """التحقق من صحة بيانات المشرف"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM assistants WHERE username = ? AND password = ?", (username, password))
-    count = cursor.fetchone()[0]
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM assistants WHERE username = ? AND password = ?", (username, password))
+        count = cursor.fetchone()[0]
     return count > 0
 
-def export_assistants_to_csv() -> str:
+def export_assistants_to_csv() -> IO[bytes]:
     """تصدير بيانات المشرفين إلى CSV"""
-    os.makedirs(TEMP_CSV_DIR, exist_ok=True)
-    filename = os.path.join(TEMP_CSV_DIR, "assistants_export.csv")
-    
-    assistants = get_all_assistants()
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["اسم_المستخدم", "كلمة_المرور", "تاريخ_الإنشاء"])
-        for assistant in assistants:
-            writer.writerow([assistant["username"], assistant["password"], assistant["created_at"]])
-    
-    return filename
+    return export_query_to_csv(
+        ["اسم_المستخدم", "كلمة_المرور", "تاريخ_الإنشاء"],
+        "SELECT username, password, created_at FROM assistants ORDER BY id"
+    )
+
+# =========================
+# Session functions
+# =========================
+
+class SessionStore:
+    """جلسات الدخول في الذاكرة مدعومة بجدول sessions، التحقق منها لا يحتاج قاعدة البيانات"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        # الرمز -> (اسم المستخدم، نوع المستخدم، وقت الانتهاء)
+        self._sessions: Dict[str, Tuple[str, str, float]] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """تحميل الجلسات السارية من قاعدة البيانات عند بدء التشغيل"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT token, username, user_type, expires_at FROM sessions WHERE revoked = 0 AND expires_at > ?",
+                (time.time(),)
+            )
+            rows = cursor.fetchall()
+        with self._lock:
+            self._sessions = {token: (username, user_type, expires_at)
+                              for token, username, user_type, expires_at in rows}
+        return len(rows)
+
+    def issue(self, username: str, user_type: str) -> str:
+        """إنشاء رمز جلسة جديد"""
+        token = secrets.token_urlsafe(32)
+        expires_at = time.time() + self.ttl
+        with get_db_connection() as conn:
+            conn.execute(
+                "INSERT INTO sessions (token, username, user_type, expires_at) VALUES (?, ?, ?, ?)",
+                (token, username, user_type, expires_at)
+            )
+        with self._lock:
+            self._sessions[token] = (username, user_type, expires_at)
+        return token
+
+    def validate(self, token: Optional[str]) -> Optional[Tuple[str, str]]:
+        """إرجاع (اسم المستخدم، نوع المستخدم) إذا كانت الجلسة سارية"""
+        if not token:
+            return None
+        session = self._sessions.get(token)
+        if session is None:
+            return None
+        if session[2] < time.time():
+            with self._lock:
+                self._sessions.pop(token, None)
+            return None
+        return session[0], session[1]
+
+    def revoke(self, token: str):
+        """إنهاء جلسة (تسجيل الخروج)"""
+        with self._lock:
+            self._sessions.pop(token, None)
+        with get_db_connection() as conn:
+            conn.execute("UPDATE sessions SET revoked = 1 WHERE token = ?", (token,))
+
+    def forget_user(self, username: str, user_type: str):
+        """إزالة جلسات مستخدم من الذاكرة بعد إبطالها في قاعدة البيانات"""
+        with self._lock:
+            self._sessions = {token: session for token, session in self._sessions.items()
+                              if session[0] != username or session[1] != user_type}
+
+    def purge_expired(self) -> int:
+        """حذف الجلسات المنتهية أو الملغاة"""
+        now = time.time()
+        with self._lock:
+            self._sessions = {token: session for token, session in self._sessions.items() if session[2] >= now}
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM sessions WHERE revoked = 1 OR expires_at < ?", (now,))
+            return cursor.rowcount
+
+session_store = SessionStore(SESSION_TTL)
+
+def _revoke_assistant_sessions(cursor: sqlite3.Cursor, username: str):
+    """إبطال جلسات المشرف ضمن نفس معاملة الحذف أو تغيير كلمة المرور"""
+    cursor.execute(
+        "UPDATE sessions SET revoked = 1 WHERE username = ? AND user_type = 'assistant'",
+        (username,)
+    )
+
+# =========================
+# Campaigns functions
+# =========================
+
+# معرف الجولة المفتوحة (NULL إن لم توجد)، يقرأ من الفهرس الجزئي idx_campaigns_open
+ACTIVE_CAMPAIGN_ID_SQL = "(SELECT id FROM campaigns WHERE status = 'open')"
+
+def _campaign_from_row(row: Tuple) -> Dict:
+    return {
+        "id": row[0],
+        "name": row[1],
+        "status": row[2],
+        "opened_at": row[3],
+        "closed_at": row[4],
+    }
+
+def get_active_campaign() -> Optional[Dict]:
+    """الجولة المفتوحة حالياً إن وجدت"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, name, status, opened_at, closed_at
+            FROM campaigns WHERE status = 'open'
+        """)
+        row = cursor.fetchone()
+    return _campaign_from_row(row) if row else None
+
+def get_campaign(campaign_id: int) -> Optional[Dict]:
+    """الحصول على جولة بمعرفها"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, name, status, opened_at, closed_at
+            FROM campaigns WHERE id = ?
+        """, (campaign_id,))
+        row = cursor.fetchone()
+    return _campaign_from_row(row) if row else None
+
+def get_campaigns(limit: int) -> List[Dict]:
+    """أحدث الجولات مع عدد التسليمات في كل منها"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT c.id, c.name, c.status, c.opened_at, c.closed_at,
+                   (SELECT COUNT(*) FROM deliveries d WHERE d.campaign_id = c.id)
+            FROM campaigns c
+            ORDER BY c.id DESC
+            LIMIT ?
+        """, (limit,))
+        rows = cursor.fetchall()
+    
+    campaigns = []
+    for row in rows:
+        campaign = _campaign_from_row(row)
+        campaign["deliveries"] = row[5]
+        campaigns.append(campaign)
+    return campaigns
+
+def open_campaign(name: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """فتح جولة جديدة مع إغلاق الجولة المفتوحة في نفس المعاملة.
+    
+    لا تحذف أي تسليمات: الجولة السابقة تبقى قابلة للاستعلام والتصدير.
+    تعيد (الجولة الجديدة، الجولة التي أغلقت).
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE campaigns SET status = 'closed', closed_at = CURRENT_TIMESTAMP
+                WHERE status = 'open'
+                RETURNING id, name, status, opened_at, closed_at
+            """)
+            closed = cursor.fetchall()
+            cursor.execute("""
+                INSERT INTO campaigns (name) VALUES (?)
+                RETURNING id, name, status, opened_at, closed_at
+            """, (name,))
+            opened = cursor.fetchall()
+        return _campaign_from_row(opened[0]), (_campaign_from_row(closed[0]) if closed else None)
+    except Exception as e:
+        logger.error(f"Error opening campaign: {e}")
+        return None, None
+
+def close_active_campaign() -> Tuple[bool, Optional[Dict]]:
+    """إغلاق الجولة المفتوحة، وتعيد (نجاح العملية، الجولة التي أغلقت إن وجدت)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE campaigns SET status = 'closed', closed_at = CURRENT_TIMESTAMP
+                WHERE status = 'open'
+                RETURNING id, name, status, opened_at, closed_at
+            """)
+            rows = cursor.fetchall()
+        return True, (_campaign_from_row(rows[0]) if rows else None)
+    except Exception as e:
+        logger.error(f"Error closing campaign: {e}")
+        return False, None
+
+def export_campaign_deliveries_to_csv(campaign_id: int) -> IO[bytes]:
+    """تصدير تسليمات جولة معينة إلى CSV"""
+    return export_query_to_csv(
+        ["المشرف", "رقم_الجواز", "اسم_العضو", "تاريخ_التسليم"],
+        """
+            SELECT supervisor, passport, member_name, delivery_date
+            FROM deliveries WHERE campaign_id = ?
+            ORDER BY id DESC
+        """,
+        (campaign_id,)
+    )
 
 # =========================
 # Deliveries functions
 # =========================
 
 def add_delivery(supervisor: str, passport: str, member_name: str, delivery_date: str = None) -> bool:
-    """إضافة تسليم جديد"""
+    """إضافة تسليم جديد إلى الجولة المفتوحة، ولا يسجل شيء إن لم توجد جولة مفتوحة"""
+    passport_key = normalize_passport(passport)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        if delivery_date:
-            cursor.execute("""
-                INSERT INTO deliveries (supervisor, passport, member_name, delivery_date)
-                VALUES (?, ?, ?, ?)
-            """, (supervisor, passport, member_name, delivery_date))
-        else:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO deliveries (supervisor, passport, member_name)
-                VALUES (?, ?, ?)
-            """, (supervisor, passport, member_name))
-        conn.commit()
-        conn.close()
-        return True
+                INSERT INTO deliveries (supervisor, passport, passport_key, member_name, delivery_date, campaign_id)
+                SELECT ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), id
+                FROM campaigns WHERE status = 'open'
+            """, (supervisor, passport, passport_key, member_name, delivery_date))
+            added = cursor.rowcount > 0
+        if not added:
+            logger.warning(f"Delivery for {passport_key} by {supervisor} not recorded: no open campaign")
+        return added
     except Exception as e:
         logger.error(f"Error adding delivery: {e}")
         return False
 
 def check_existing_delivery(passport: str) -> Optional[Dict]:
-    """البحث عن تسليم موجود"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, supervisor, passport, member_name, delivery_date
-        FROM deliveries WHERE passport = ?
-        ORDER BY id DESC LIMIT 1
-    """, (passport,))
-    row = cursor.fetchone()
-    conn.close()
+    """آخر تسليم للعضو في الجولة المفتوحة: فحص واحد على idx_deliveries_campaign_latest ثم قراءة الصف بمعرفه"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT id, supervisor, passport, member_name, delivery_date
+            FROM deliveries
+            WHERE campaign_id = {ACTIVE_CAMPAIGN_ID_SQL} AND passport_key = ?
+            ORDER BY id DESC LIMIT 1
+        """, (normalize_passport(passport),))
+        row = cursor.fetchone()
     
     if row:
         return {
@@ -628,15 +1697,14 @@ def check_existing_delivery(passport: str) -> Optional[Dict]:
 
 def get_deliveries_by_supervisor(supervisor: str) -> List[Dict]:
     """الحصول على تسليمات المشرف"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, supervisor, passport, member_name, delivery_date
-        FROM deliveries WHERE supervisor = ?
-        ORDER BY id DESC
-    """, (supervisor,))
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, supervisor, passport, member_name, delivery_date
+            FROM deliveries WHERE supervisor = ?
+            ORDER BY id DESC
+        """, (supervisor,))
+        rows = cursor.fetchall()
     
     return [{
         "id": row[0],
@@ -648,14 +1716,13 @@ def get_deliveries_by_supervisor(supervisor: str) -> List[Dict]:
 
 def get_all_deliveries() -> List[Dict]:
     """الحصول على جميع التسليمات"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, supervisor, passport, member_name, delivery_date
-        FROM deliveries ORDER BY id DESC
-    """)
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, supervisor, passport, member_name, delivery_date
+            FROM deliveries ORDER BY id DESC
+        """)
+        rows = cursor.fetchall()
     
     return [{
         "id": row[0],
@@ -668,97 +1735,188 @@ def get_all_deliveries() -> List[Dict]:
 def delete_all_deliveries() -> bool:
     """حذف جميع التسليمات"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM deliveries")
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM deliveries")
         return True
     except Exception as e:
         logger.error(f"Error deleting all deliveries: {e}")
         return False
 
-def export_deliveries_to_csv() -> str:
+def export_deliveries_to_csv() -> IO[bytes]:
     """تصدير التسليمات إلى CSV"""
-    os.makedirs(TEMP_CSV_DIR, exist_ok=True)
-    filename = os.path.join(TEMP_CSV_DIR, "deliveries_export.csv")
-    
-    deliveries = get_all_deliveries()
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["المشرف", "رقم_الجواز", "اسم_العضو", "تاريخ_التسليم"])
-        for delivery in deliveries:
-            writer.writerow([delivery["supervisor"], delivery["passport"], delivery["member_name"], delivery["delivery_date"]])
+    return export_query_to_csv(
+        ["المشرف", "رقم_الجواز", "اسم_العضو", "تاريخ_التسليم", "الجولة"],
+        """
+            SELECT d.supervisor, d.passport, d.member_name, d.delivery_date, c.name
+            FROM deliveries d
+            LEFT JOIN campaigns c ON c.id = d.campaign_id
+            ORDER BY d.id DESC
+        """
+    )
+
+def export_supervisor_deliveries_to_csv(supervisor: str) -> IO[bytes]:
+    """تصدير تسليمات مشرف معين إلى CSV"""
+    return export_query_to_csv(
+        ["المشرف", "رقم_الجواز", "اسم_العضو", "تاريخ_التسليم"],
+        """
+            SELECT supervisor, passport, member_name, delivery_date
+            FROM deliveries WHERE supervisor = ?
+            ORDER BY id DESC
+        """,
+        (supervisor,)
+    )
+
+DELIVERIES_CSV_COLUMNS = ["المشرف", "رقم_الجواز", "اسم_العضو", "تاريخ_التسليم"]
+
+def _parse_delivery_row(row: Dict) -> Dict:
+    """تحويل صف CSV إلى بيانات تسليم"""
+    if not row.get("المشرف") or not row.get("رقم_الجواز") or not row.get("اسم_العضو"):
+        raise ValueError("المشرف ورقم الجواز واسم العضو مطلوبان")
     
-    return filename
+    return {
+        "supervisor": row["المشرف"],
+        "passport": row["رقم_الجواز"],
+        "member_name": row["اسم_العضو"],
+        "delivery_date": row.get("تاريخ_التسليم", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    }
+
+def iter_deliveries_csv(file_path: str, report: Optional[CsvValidationReport] = None) -> Iterator[Dict]:
+    """قراءة التسليمات الصالحة من ملف CSV تدريجياً"""
+    return iter_csv_rows(file_path, DELIVERIES_CSV_COLUMNS, _parse_delivery_row, report)
 
-def validate_deliveries_csv(file_path: str) -> Tuple[bool, str, List[Dict]]:
+def validate_deliveries_csv(file_path: str) -> Tuple[bool, str, int]:
     """التحقق من صحة ملف CSV للتسليمات"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-        
-        if not rows:
-            return False, "❌ الملف فارغ أو لا يحتوي على بيانات", []
-        
-        required_columns = ["المشرف", "رقم_الجواز", "اسم_العضو", "تاريخ_التسليم"]
-        missing_columns = [col for col in required_columns if col not in rows[0].keys()]
-        
-        if missing_columns:
-            return False, f"❌ الأعمدة التالية مفقودة: {', '.join(missing_columns)}", []
-        
-        valid_rows = []
-        errors = []
-        
-        for i, row in enumerate(rows, 1):
-            if not row.get("المشرف") or not row.get("رقم_الجواز") or not row.get("اسم_العضو"):
-                errors.append(f"الصف {i}: المشرف ورقم الجواز واسم العضو مطلوبان")
+    report = CsvValidationReport()
+    return validate_csv_file(iter_deliveries_csv(file_path, report), report)
+
+def _import_deliveries_chunk(conn: sqlite3.Connection, rows: List[Dict]) -> Tuple[int]:
+    # الجولة تحدد داخل معاملة الإدراج نفسها، فإغلاقها أثناء الرفع يوقف الاستيراد بدل تسليمات بلا جولة
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT INTO deliveries (supervisor, passport, passport_key, member_name, delivery_date, campaign_id)
+        SELECT ?, ?, ?, ?, ?, id FROM campaigns WHERE status = 'open'
+    """, [(row["supervisor"], row["passport"], normalize_passport(row["passport"]), row["member_name"],
+           row["delivery_date"]) for row in rows])
+    if cursor.rowcount < len(rows):
+        raise ImportAborted("لا توجد جولة توزيع مفتوحة، لم يتم استيراد باقي التسليمات")
+    return (len(rows),)
+
+def import_deliveries_from_csv(csv_data: Iterable[Dict], chunk_size: int = CSV_IMPORT_CHUNK_SIZE) -> Tuple[int, List]:
+    """استيراد التسليمات من CSV على دفعات إلى الجولة المفتوحة"""
+    (added_count,), errors = import_csv_chunks(csv_data, chunk_size, _import_deliveries_chunk, (0,), "deliveries")
+    return added_count, errors
+
+def parse_passport_list(text: str) -> List[str]:
+    """أرقام الجوازات من نص ملصق: رقم في كل سطر (أو مفصولة بفواصل)"""
+    return [passport.strip() for passport in re.split(r"[\n,;،]+", text) if passport.strip()]
+
+def read_passports_csv(file_path: str, limit: int) -> List[str]:
+    """أرقام الجوازات من ملف CSV: عمود رقم_الجواز إن وجد، وإلا العمود الأول.
+
+    تتوقف القراءة بعد limit + 1 جواز، فيكفي ذلك لمعرفة تجاوز الحد دون قراءة باقي الملف.
+    """
+    passports = []
+    column = None
+    with open(file_path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f):
+            if not row:
                 continue
-            
-            valid_rows.append({
-                "supervisor": row["المشرف"],
-                "passport": row["رقم_الجواز"],
-                "member_name": row["اسم_العضو"],
-                "delivery_date": row.get("تاريخ_التسليم", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            if column is None:
+                header = [cell.strip() for cell in row]
+                if "رقم_الجواز" in header:
+                    column = header.index("رقم_الجواز")
+                    continue
+                column = 0
+            if len(row) > column and row[column].strip():
+                passports.append(row[column].strip())
+                if len(passports) > limit:
+                    break
+    return passports
+
+def resolve_delivery_batch(passports: List[str]) -> Dict[str, List]:
+    """مطابقة دفعة جوازات مع الأعضاء وتسليمات الجولة المفتوحة باستعلام ربط واحد.
+    
+    تعيد المجموعات: ready (جاهز للتسليم)، delivered (سُلّم في هذه الجولة)،
+    missing (غير مسجل)، و duplicates (جوازات مكررة في الدفعة نفسها).
+    """
+    staged = {}
+    duplicates = []
+    for passport in passports:
+        passport_key = normalize_passport(passport)
+        if passport_key in staged:
+            duplicates.append(passport)
+        else:
+            staged[passport_key] = passport
+    
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS delivery_batch_staging (
+                seq INTEGER PRIMARY KEY,
+                passport TEXT,
+                passport_key TEXT
+            )
+        """)
+        cursor.execute("DELETE FROM delivery_batch_staging")
+        cursor.executemany(
+            "INSERT INTO delivery_batch_staging (passport, passport_key) VALUES (?, ?)",
+            [(passport, passport_key) for passport_key, passport in staged.items()]
+        )
+        cursor.execute(f"""
+            SELECT s.passport, m.passport, m.name, d.supervisor, d.delivery_date
+            FROM delivery_batch_staging s
+            LEFT JOIN members m ON m.passport_key = s.passport_key
+            LEFT JOIN deliveries d ON d.id = (
+                SELECT MAX(id) FROM deliveries
+                WHERE campaign_id = {ACTIVE_CAMPAIGN_ID_SQL} AND passport_key = s.passport_key
+            )
+            ORDER BY s.seq
+        """)
+        rows = cursor.fetchall()
+        cursor.execute("DELETE FROM delivery_batch_staging")
+    
+    batch = {"ready": [], "delivered": [], "missing": [], "duplicates": duplicates}
+    for entered, passport, name, supervisor, delivery_date in rows:
+        if passport is None:
+            batch["missing"].append(entered)
+        elif supervisor is not None:
+            batch["delivered"].append({
+                "passport": passport,
+                "name": name,
+                "supervisor": supervisor,
+                "delivery_date": delivery_date
             })
-        
-        if errors and len(errors) > 5:
-            error_msg = "\n".join(errors[:5]) + f"\n... وغيرها {len(errors) - 5} خطأ"
-        elif errors:
-            error_msg = "\n".join(errors)
         else:
-            error_msg = ""
-        
-        if errors:
-            return False, f"❌ وجدت الأخطاء التالية:\n{error_msg}", valid_rows
-        
-        return True, f"✅ الملف صالح. عدد السجلات: {len(valid_rows)}", valid_rows
-        
-    except Exception as e:
-        return False, f"❌ خطأ في قراءة الملف: {str(e)}", []
+            batch["ready"].append({"passport": passport, "name": name})
+    return batch
 
-def import_deliveries_from_csv(csv_data: List[Dict]) -> Tuple[int, List]:
-    """استيراد التسليمات من CSV"""
-    added_count = 0
-    errors = []
+def add_deliveries_batch(supervisor: str, members: List[Dict]) -> int:
+    """تسجيل تسليمات دفعة في معاملة واحدة، وتعيد عدد المسجل.
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    for i, row in enumerate(csv_data, 1):
-        try:
-            cursor.execute("""
-                INSERT INTO deliveries (supervisor, passport, member_name, delivery_date)
-                VALUES (?, ?, ?, ?)
-            """, (row["supervisor"], row["passport"], row["member_name"], row["delivery_date"]))
-            added_count += 1
-        except Exception as e:
-            errors.append(f"الصف {i}: {str(e)}")
-    
-    conn.commit()
-    conn.close()
-    return added_count, errors
+    يتخطى من سُلّم له في الجولة المفتوحة منذ عرض الدفعة، ولا يسجل شيئاً إن أغلقت الجولة.
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            rows = []
+            for member in members:
+                passport_key = normalize_passport(member["passport"])
+                rows.append((supervisor, member["passport"], passport_key, member["name"], passport_key))
+            cursor.executemany("""
+                INSERT INTO deliveries (supervisor, passport, passport_key, member_name, campaign_id)
+                SELECT ?, ?, ?, ?, c.id
+                FROM campaigns c
+                WHERE c.status = 'open'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM deliveries d
+                      WHERE d.campaign_id = c.id AND d.passport_key = ?
+                  )
+            """, rows)
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Error adding delivery batch: {e}")
+        return 0
 
 # =========================
 # Services functions
@@ -767,11 +1925,10 @@ def import_deliveries_from_csv(csv_data: List[Dict]) -> Tuple[int, List]:
 def add_service_to_db(service_name: str) -> bool:
     """إضافة خدمة جديدة"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO services (name) VALUES (?)", (service_name,))
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO services (name) VALUES (?)", (service_name,))
+        service_registry.bump()
         return True
     except sqlite3.IntegrityError:
         return False
@@ -782,16 +1939,16 @@ def add_service_to_db(service_name: str) -> bool:
 def delete_service_from_db(service_name: str) -> bool:
     """حذف خدمة"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("DELETE FROM services WHERE name = ?", (service_name,))
-        deleted = cursor.rowcount > 0
+            cursor.execute("DELETE FROM services WHERE name = ?", (service_name,))
+            deleted = cursor.rowcount > 0
         
-        cursor.execute("DELETE FROM service_requests WHERE service_name = ?", (service_name,))
+            cursor.execute("DELETE FROM service_requests WHERE service_name = ?", (service_name,))
         
-        conn.commit()
-        conn.close()
+        if deleted:
+            service_registry.bump()
         return deleted
     except Exception as e:
         logger.error(f"Error deleting service from DB: {e}")
@@ -799,80 +1956,118 @@ def delete_service_from_db(service_name: str) -> bool:
 
 def get_services_from_db() -> List[Dict]:
     """الحصول على جميع الخدمات"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, created_at FROM services ORDER BY id")
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name, created_at FROM services ORDER BY id")
+        rows = cursor.fetchall()
     return [{
         "service_id": str(row[0]),
         "service_name": row[1],
         "created_at": row[2]
     } for row in rows]
 
-def add_service_request(passport: str, service_name: str, requester: str, request_date: str = None):
-    """إضافة طلب خدمة"""
-    try:
-        conn = get_db_connection()
+class ServiceCatalog:
+    """نسخة ثابتة من قائمة الخدمات مع لوحات المفاتيح الجاهزة"""
+
+    def __init__(self, version: int, services: List[Dict]):
+        self.version = version
+        self.services = services
+        self.ids = {service["service_name"]: service["service_id"] for service in services}
+        self.menu_kb = services_menu_kb(services)
+        self.selection_kb = services_selection_kb(services)
+
+    def __bool__(self) -> bool:
+        return bool(self.services)
+
+    def __contains__(self, service_name: str) -> bool:
+        return service_name in self.ids
+
+class ServiceRegistry:
+    """قائمة الخدمات في الذاكرة، يعاد بناؤها فقط عند تغير الإصدار (إضافة أو حذف خدمة)"""
+
+    def __init__(self):
+        self.version = 0
+        self._catalog: Optional[ServiceCatalog] = None
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+
+    def cached(self) -> Optional[ServiceCatalog]:
+        """القائمة الحالية إن كانت محدثة، دون الرجوع لقاعدة البيانات"""
+        catalog = self._catalog
+        if catalog is not None and catalog.version == self.version:
+            return catalog
+        return None
+
+    def get(self) -> ServiceCatalog:
+        """القائمة الحالية، مع إعادة بنائها من قاعدة البيانات إذا تغير الإصدار"""
+        catalog = self.cached()
+        if catalog is not None:
+            return catalog
+        version = self.version
+        catalog = ServiceCatalog(version, get_services_from_db())
+        with self._lock:
+            if self._catalog is None or self._catalog.version < version:
+                self._catalog = catalog
+        return catalog
+
+service_registry = ServiceRegistry()
+
+def request_service(passport: str, service_name: str) -> bool:
+    """تسجيل طلب خدمة لعضو مسجل في عبارة واحدة.
+
+    يرجع True إذا أُضيف الطلب، وFalse إذا كان العضو قد طلب الخدمة مسبقاً (أو غير مسجل).
+    """
+    with get_db_connection() as conn:
         cursor = conn.cursor()
-        if request_date:
-            cursor.execute("""
-                INSERT INTO service_requests (passport, service_name, requester, request_date)
-                VALUES (?, ?, ?, ?)
-            """, (passport, service_name, requester, request_date))
-        else:
-            cursor.execute("""
-                INSERT INTO service_requests (passport, service_name, requester)
-                VALUES (?, ?, ?)
-            """, (passport, service_name, requester))
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.exception("Error inserting service request")
+        cursor.execute("""
+            INSERT OR IGNORE INTO service_requests (passport, passport_key, service_name, requester)
+            SELECT passport, passport_key, ?, name FROM members WHERE passport_key = ?
+            RETURNING id
+        """, (service_name, normalize_passport(passport)))
+        return bool(cursor.fetchall())
 
 def get_service_requests_from_db() -> List[Tuple]:
     """الحصول على جميع طلبات الخدمات"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, passport, service_name, request_date, requester
-        FROM service_requests ORDER BY id
-    """)
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, passport, service_name, request_date, requester
+            FROM service_requests ORDER BY id
+        """)
+        rows = cursor.fetchall()
     return rows
 
 def get_service_requests_by_service(service_name: str = None) -> List[Tuple]:
     """الحصول على طلبات خدمة معينة"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
     
-    if service_name:
-        cursor.execute("""
-            SELECT id, passport, service_name, request_date, requester 
-            FROM service_requests 
-            WHERE service_name = ?
-            ORDER BY id
-        """, (service_name,))
-    else:
-        cursor.execute("""
-            SELECT id, passport, service_name, request_date, requester 
-            FROM service_requests 
-            ORDER BY id
-        """)
+        if service_name:
+            cursor.execute("""
+                SELECT id, passport, service_name, request_date, requester 
+                FROM service_requests 
+                WHERE service_name = ?
+                ORDER BY id
+            """, (service_name,))
+        else:
+            cursor.execute("""
+                SELECT id, passport, service_name, request_date, requester 
+                FROM service_requests 
+                ORDER BY id
+            """)
     
-    rows = cursor.fetchall()
-    conn.close()
+        rows = cursor.fetchall()
     return rows
 
 def delete_all_service_requests() -> bool:
     """حذف جميع طلبات الخدمات"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM service_requests")
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM service_requests")
         return True
     except Exception as e:
         logger.error(f"Error deleting all service requests from DB: {e}")
@@ -881,139 +2076,635 @@ def delete_all_service_requests() -> bool:
 def delete_service_requests_by_service(service_name: str) -> bool:
     """حذف طلبات خدمة معينة"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM service_requests WHERE service_name = ?", (service_name,))
-        deleted = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM service_requests WHERE service_name = ?", (service_name,))
+            deleted = cursor.rowcount > 0
         return deleted
     except Exception as e:
         logger.error(f"Error deleting service requests by service: {e}")
         return False
 
-def check_existing_service_request(passport: str, service_name: str) -> bool:
-    """التحقق من وجود طلب خدمة مسبق"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT COUNT(*) FROM service_requests 
-        WHERE passport = ? AND service_name = ?
-    """, (passport, service_name))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count > 0
+def export_service_requests_to_csv(service_name: str = None) -> IO[bytes]:
+    """تصدير طلبات الخدمات إلى CSV"""
+    header = ["رقم_الجواز", "الخدمة", "تاريخ_الطلب", "مقدم_الطلب"]
+    if service_name:
+        return export_query_to_csv(header, """
+            SELECT passport, service_name, request_date, requester
+            FROM service_requests
+            WHERE service_name = ?
+            ORDER BY id
+        """, (service_name,))
+    return export_query_to_csv(header, """
+        SELECT passport, service_name, request_date, requester
+        FROM service_requests
+        ORDER BY id
+    """)
 
-def get_service_statistics() -> Dict[str, int]:
-    """إحصائيات الخدمات"""
-    services = get_services_from_db()
-    stats = {}
+SERVICE_REQUESTS_CSV_COLUMNS = ["رقم_الجواز", "الخدمة", "تاريخ_الطلب", "مقدم_الطلب"]
+
+def _parse_service_request_row(row: Dict) -> Dict:
+    """تحويل صف CSV إلى طلب خدمة"""
+    if not row.get("رقم_الجواز") or not row.get("الخدمة") or not row.get("مقدم_الطلب"):
+        raise ValueError("رقم الجواز والخدمة ومقدم الطلب مطلوبان")
     
-    conn = get_db_connection()
+    return {
+        "passport": row["رقم_الجواز"],
+        "service_name": row["الخدمة"],
+        "request_date": row.get("تاريخ_الطلب", datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        "requester": row["مقدم_الطلب"]
+    }
+
+def iter_service_requests_csv(file_path: str, report: Optional[CsvValidationReport] = None) -> Iterator[Dict]:
+    """قراءة طلبات الخدمات الصالحة من ملف CSV تدريجياً"""
+    return iter_csv_rows(file_path, SERVICE_REQUESTS_CSV_COLUMNS, _parse_service_request_row, report)
+
+def validate_service_requests_csv(file_path: str) -> Tuple[bool, str, int]:
+    """التحقق من صحة ملف CSV لطلبات الخدمات"""
+    report = CsvValidationReport()
+    return validate_csv_file(iter_service_requests_csv(file_path, report), report)
+
+def _import_service_requests_chunk(conn: sqlite3.Connection, rows: List[Dict]) -> Tuple[int, int]:
     cursor = conn.cursor()
-    
-    for service in services:
-        service_name = service["service_name"]
-        cursor.execute("SELECT COUNT(*) FROM service_requests WHERE service_name = ?", (service_name,))
-        count = cursor.fetchone()[0]
-        stats[service_name] = count
-    
-    conn.close()
-    return stats
+    cursor.executemany("""
+        INSERT OR IGNORE INTO service_requests (passport, passport_key, service_name, request_date, requester)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(row["passport"], normalize_passport(row["passport"]), row["service_name"], row["request_date"],
+           row["requester"]) for row in rows])
+    return cursor.rowcount, len(rows) - cursor.rowcount
+
+def import_service_requests_from_csv(csv_data: Iterable[Dict], chunk_size: int = CSV_IMPORT_CHUNK_SIZE) -> Tuple[int, int, List]:
+    """استيراد طلبات الخدمات من CSV على دفعات، مع تجاهل الطلبات المكررة"""
+    (added_count, skipped_count), errors = import_csv_chunks(
+        csv_data, chunk_size, _import_service_requests_chunk, (0, 0), "service requests"
+    )
+    return added_count, skipped_count, errors
 
-def export_service_requests_to_csv(service_name: str = None) -> str:
-    """تصدير طلبات الخدمات إلى CSV"""
-    os.makedirs(TEMP_CSV_DIR, exist_ok=True)
-    
-    if service_name:
-        filename = os.path.join(TEMP_CSV_DIR, f"service_requests_{service_name}.csv")
-        requests = get_service_requests_by_service(service_name)
-    else:
-        filename = os.path.join(TEMP_CSV_DIR, "all_service_requests.csv")
-        requests = get_service_requests_by_service()
-    
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["رقم_الجواز", "الخدمة", "تاريخ_الطلب", "مقدم_الطلب"])
-        for request in requests:
-            writer.writerow([request[1], request[2], request[3], request[4]])
+# =========================
+# Broadcast functions
+# =========================
+
+BROADCAST_JOB_COLUMNS = ("id", "message", "admin_chat_id", "progress_message_id", "status",
+                         "last_user_row_id", "total", "sent", "failed")
+
+def create_broadcast_job(message: str, admin_chat_id: int) -> Dict:
+    """إنشاء مهمة بث جديدة لجميع المستخدمين"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM stats_counters WHERE name = 'users'")
+        row = cursor.fetchone()
+        total = row[0] if row else 0
+        cursor.execute(
+            "INSERT INTO broadcast_jobs (message, admin_chat_id, total) VALUES (?, ?, ?)",
+            (message, admin_chat_id, total)
+        )
+        job_id = cursor.lastrowid
+    return get_broadcast_job(job_id)
+
+def get_broadcast_job(job_id: int) -> Optional[Dict]:
+    """الحصول على مهمة بث"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(BROADCAST_JOB_COLUMNS)} FROM broadcast_jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+    return dict(zip(BROADCAST_JOB_COLUMNS, row)) if row else None
+
+def get_unfinished_broadcast_jobs() -> List[Dict]:
+    """مهام البث التي لم تكتمل (للاستئناف بعد إعادة التشغيل)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {', '.join(BROADCAST_JOB_COLUMNS)} FROM broadcast_jobs WHERE status = 'running' ORDER BY id"
+        )
+        rows = cursor.fetchall()
+    return [dict(zip(BROADCAST_JOB_COLUMNS, row)) for row in rows]
+
+def set_broadcast_progress_message(job_id: int, message_id: int):
+    """حفظ رقم رسالة التقدم لتحديثها أثناء البث"""
+    with get_db_connection() as conn:
+        conn.execute("UPDATE broadcast_jobs SET progress_message_id = ? WHERE id = ?", (message_id, job_id))
+
+def get_broadcast_recipients(after_row_id: int, limit: int) -> List[Tuple[int, int]]:
+    """الدفعة التالية من المستخدمين بعد المؤشر: (رقم الصف، معرف المستخدم)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, user_id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+            (after_row_id, limit)
+        )
+        return cursor.fetchall()
+
+def save_broadcast_progress(job_id: int, last_user_row_id: int, sent: int, failed: int):
+    """حفظ مؤشر الاستئناف والعدادات بعد كل دفعة"""
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE broadcast_jobs SET last_user_row_id = ?, sent = ?, failed = ? WHERE id = ?",
+            (last_user_row_id, sent, failed, job_id)
+        )
+
+def finish_broadcast_job(job_id: int, status: str = "done"):
+    """إنهاء مهمة البث"""
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE broadcast_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (status, job_id)
+        )
+
+# =========================
+# Persistence functions
+# =========================
+
+def load_persistent_data(kind: str, key_id: int) -> Optional[bytes]:
+    """قراءة بيانات مستخدم أو محادثة واحدة (مسلسلة)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT data FROM persistence_data WHERE kind = ? AND id = ?", (kind, key_id))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def save_persistent_data(kind: str, key_id: int, data: bytes):
+    """حفظ بيانات مستخدم أو محادثة واحدة"""
+    with get_db_connection() as conn:
+        conn.execute("""
+            INSERT INTO persistence_data (kind, id, data) VALUES (?, ?, ?)
+            ON CONFLICT(kind, id) DO UPDATE SET data = excluded.data
+        """, (kind, key_id, data))
+
+def delete_persistent_data(kind: str, key_id: int):
+    """حذف بيانات مستخدم أو محادثة"""
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM persistence_data WHERE kind = ? AND id = ?", (kind, key_id))
+
+def load_conversation_states(name: str) -> List[Tuple[str, bytes]]:
+    """حالات محادثة واحدة: (المفتاح، الحالة المسلسلة)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, state FROM persistence_conversations WHERE name = ?", (name,))
+        return cursor.fetchall()
+
+def save_conversation_state(name: str, key: str, state: Optional[bytes]):
+    """حفظ حالة محادثة، أو حذفها عند انتهاء المحادثة"""
+    with get_db_connection() as conn:
+        if state is None:
+            conn.execute("DELETE FROM persistence_conversations WHERE name = ? AND key = ?", (name, key))
+        else:
+            conn.execute("""
+                INSERT INTO persistence_conversations (name, key, state) VALUES (?, ?, ?)
+                ON CONFLICT(name, key) DO UPDATE SET state = excluded.state
+            """, (name, key, state))
+
+# =========================
+# Aggregation functions
+# =========================
+
+def get_stats_counters() -> Dict[str, int]:
+    """قراءة عدادات الإحصائيات العامة دون المرور على الجداول"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, value FROM stats_counters")
+        counters = dict(cursor.fetchall())
+    return {name: counters.get(name, 0) for name, _, _ in STATS_COUNTERS}
+
+def export_statistics_to_csv() -> IO[bytes]:
+    """تصدير الإحصائيات العامة إلى CSV"""
+    counters = get_stats_counters()
+    return write_csv_export(["نوع الإحصائية", "العدد"], [[
+        ["إجمالي المسجلين", counters["members"]],
+        ["إجمالي أفراد الأسر", counters["family_members"]],
+        ["إجمالي التسليمات", counters["deliveries"]],
+        ["إجمالي المستخدمين", counters["users"]],
+        ["إجمالي المشرفين", counters["assistants"]],
+        ["إجمالي طلبات الخدمات", counters["service_requests"]],
+    ]])
+
+def get_members_summary() -> Dict:
+    """ملخص المسجلين: الإجمالي ومجموع أفراد الأسر والتوزيع حسب الصفة باستعلام واحد"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(role, 'غير محدد'), COUNT(*), COALESCE(SUM(family_members), 0)
+            FROM members
+            GROUP BY role
+            ORDER BY MIN(id)
+        """)
+        rows = cursor.fetchall()
     
-    return filename
+    return {
+        "total": sum(row[1] for row in rows),
+        "total_family_members": sum(row[2] for row in rows),
+        "roles": [(row[0], row[1]) for row in rows],
+    }
 
-def validate_service_requests_csv(file_path: str) -> Tuple[bool, str, List[Dict]]:
-    """التحقق من صحة ملف CSV لطلبات الخدمات"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-        
-        if not rows:
-            return False, "❌ الملف فارغ أو لا يحتوي على بيانات", []
-        
-        required_columns = ["رقم_الجواز", "الخدمة", "تاريخ_الطلب", "مقدم_الطلب"]
-        missing_columns = [col for col in required_columns if col not in rows[0].keys()]
-        
-        if missing_columns:
-            return False, f"❌ الأعمدة التالية مفقودة: {', '.join(missing_columns)}", []
-        
-        valid_rows = []
-        errors = []
-        
-        for i, row in enumerate(rows, 1):
-            if not row.get("رقم_الجواز") or not row.get("الخدمة") or not row.get("مقدم_الطلب"):
-                errors.append(f"الصف {i}: رقم الجواز والخدمة ومقدم الطلب مطلوبان")
-                continue
-            
-            valid_rows.append({
-                "passport": row["رقم_الجواز"],
-                "service_name": row["الخدمة"],
-                "request_date": row.get("تاريخ_الطلب", datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
-                "requester": row["مقدم_الطلب"]
-            })
-        
-        if errors and len(errors) > 5:
-            error_msg = "\n".join(errors[:5]) + f"\n... وغيرها {len(errors) - 5} خطأ"
-        elif errors:
-            error_msg = "\n".join(errors)
+def get_deliveries_summary_by_supervisor(campaign_id: Optional[int] = None) -> List[Tuple[str, int]]:
+    """عدد التسليمات لكل مشرف، في جولة معينة أو في جميع الجولات"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if campaign_id is None:
+            cursor.execute("""
+                SELECT supervisor, COUNT(*)
+                FROM deliveries
+                GROUP BY supervisor
+                ORDER BY MAX(id) DESC
+            """)
         else:
-            error_msg = ""
-        
-        if errors:
-            return False, f"❌ وجدت الأخطاء التالية:\n{error_msg}", valid_rows
-        
-        return True, f"✅ الملف صالح. عدد السجلات: {len(valid_rows)}", valid_rows
-        
-    except Exception as e:
-        return False, f"❌ خطأ في قراءة الملف: {str(e)}", []
+            cursor.execute("""
+                SELECT supervisor, COUNT(*)
+                FROM deliveries
+                WHERE campaign_id = ?
+                GROUP BY supervisor
+                ORDER BY MAX(id) DESC
+            """, (campaign_id,))
+        return cursor.fetchall()
+
+def count_supervisor_deliveries(supervisor: str) -> int:
+    """عدد تسليمات مشرف معين"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM deliveries WHERE supervisor = ?", (supervisor,))
+        return cursor.fetchone()[0]
+
+def get_supervisor_deliveries_by_date(supervisor: str) -> List[Tuple[str, int]]:
+    """عدد تسليمات المشرف لكل يوم"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT
+                CASE WHEN instr(delivery_date, ' ') > 0
+                     THEN substr(delivery_date, 1, instr(delivery_date, ' ') - 1)
+                     ELSE delivery_date END AS day,
+                COUNT(*)
+            FROM deliveries
+            WHERE supervisor = ?
+            GROUP BY day
+            ORDER BY MAX(id) DESC
+        """, (supervisor,))
+        return cursor.fetchall()
+
+def count_service_requests(service_name: str) -> int:
+    """عدد طلبات خدمة معينة"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM service_requests WHERE service_name = ?", (service_name,))
+        return cursor.fetchone()[0]
+
+def get_service_statistics() -> Dict[str, int]:
+    """إحصائيات الخدمات: عدد الطلبات لكل خدمة مرتبة حسب ترتيب إضافة الخدمات"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT s.name, COUNT(r.id)
+            FROM services s
+            LEFT JOIN service_requests r ON r.service_name = s.name
+            GROUP BY s.id
+            ORDER BY s.id
+        """)
+        return dict(cursor.fetchall())
+
+# =========================
+# Async data access
+# =========================
+
+_db_executor: Optional[ThreadPoolExecutor] = None
+_db_executor_lock = threading.Lock()
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """الحصول على المنفذ المخصص لعمليات قاعدة البيانات"""
+    global _db_executor
+    if _db_executor is None:
+        with _db_executor_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+    return _db_executor
+
+def shutdown_db_executor():
+    """إيقاف منفذ قاعدة البيانات بعد انتهاء المهام الجارية"""
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is not None:
+            _db_executor.shutdown(wait=True)
+            _db_executor = None
+
+async def run_db(func, *args, **kwargs):
+    """تشغيل دالة قاعدة بيانات متزامنة على المنفذ المخصص دون إيقاف حلقة الأحداث"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(func, *args, **kwargs))
+
+def to_async(func):
+    """إنشاء نسخة قابلة للانتظار من دالة قاعدة بيانات متزامنة"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    wrapper.__name__ = f"{func.__name__}_async"
+    wrapper.__qualname__ = wrapper.__name__
+    return wrapper
+
+# الأعضاء
+add_member_async = to_async(add_member)
+is_passport_registered_async = to_async(is_passport_registered)
+get_member_by_passport_async = to_async(get_member_by_passport)
+get_all_members_async = to_async(get_all_members)
+delete_all_members_async = to_async(delete_all_members)
+search_members_async = to_async(search_members)
+lookup_members_async = to_async(lookup_members)
+export_members_to_csv_async = to_async(export_members_to_csv)
+validate_members_csv_async = to_async(validate_members_csv)
+import_members_from_csv_async = to_async(import_members_from_csv)
+
+count_member_conflicts_async = to_async(count_member_conflicts)
+export_member_conflicts_to_csv_async = to_async(export_member_conflicts_to_csv)
+mark_member_conflicts_exported_async = to_async(mark_member_conflicts_exported)
+
+async def lookup_members_cached(text: str) -> List[Dict]:
+    """اقتراحات البحث المضمن مع ذاكرة قصيرة المدة للاستعلامات المتكررة أثناء الكتابة"""
+    key = " ".join(text.split()).casefold()
+    members = inline_lookup_cache.get(key)
+    if members is None:
+        members = await lookup_members_async(text, INLINE_RESULTS_LIMIT)
+        inline_lookup_cache.put(key, members)
+    return members
+
+# المستخدمون
+add_user_if_not_exists_async = to_async(add_user_if_not_exists)
+get_all_users_async = to_async(get_all_users)
+
+# المشرفون
+add_assistant_async = to_async(add_assistant)
+delete_assistant_async = to_async(delete_assistant)
+update_assistant_password_async = to_async(update_assistant_password)
+get_all_assistants_async = to_async(get_all_assistants)
+validate_assistant_async = to_async(validate_assistant)
+export_assistants_to_csv_async = to_async(export_assistants_to_csv)
+
+# الجلسات
+issue_session_async = to_async(session_store.issue)
+revoke_session_async = to_async(session_store.revoke)
+purge_expired_sessions_async = to_async(session_store.purge_expired)
+
+# الجولات
+get_active_campaign_async = to_async(get_active_campaign)
+get_campaign_async = to_async(get_campaign)
+get_campaigns_async = to_async(get_campaigns)
+open_campaign_async = to_async(open_campaign)
+close_active_campaign_async = to_async(close_active_campaign)
+export_campaign_deliveries_to_csv_async = to_async(export_campaign_deliveries_to_csv)
+
+# التسليمات
+add_delivery_async = to_async(add_delivery)
+check_existing_delivery_async = to_async(check_existing_delivery)
+get_deliveries_by_supervisor_async = to_async(get_deliveries_by_supervisor)
+get_all_deliveries_async = to_async(get_all_deliveries)
+delete_all_deliveries_async = to_async(delete_all_deliveries)
+export_deliveries_to_csv_async = to_async(export_deliveries_to_csv)
+export_supervisor_deliveries_to_csv_async = to_async(export_supervisor_deliveries_to_csv)
+validate_deliveries_csv_async = to_async(validate_deliveries_csv)
+import_deliveries_from_csv_async = to_async(import_deliveries_from_csv)
+resolve_delivery_batch_async = to_async(resolve_delivery_batch)
+add_deliveries_batch_async = to_async(add_deliveries_batch)
+read_passports_csv_async = to_async(read_passports_csv)
+
+# الخدمات
+add_service_to_db_async = to_async(add_service_to_db)
+delete_service_from_db_async = to_async(delete_service_from_db)
+get_services_from_db_async = to_async(get_services_from_db)
+request_service_async = to_async(request_service)
+get_service_requests_from_db_async = to_async(get_service_requests_from_db)
+get_service_requests_by_service_async = to_async(get_service_requests_by_service)
+delete_all_service_requests_async = to_async(delete_all_service_requests)
+delete_service_requests_by_service_async = to_async(delete_service_requests_by_service)
+export_service_requests_to_csv_async = to_async(export_service_requests_to_csv)
+validate_service_requests_csv_async = to_async(validate_service_requests_csv)
+import_service_requests_from_csv_async = to_async(import_service_requests_from_csv)
+
+async def get_service_catalog() -> ServiceCatalog:
+    """قائمة الخدمات من الذاكرة، ولا تُقرأ قاعدة البيانات إلا بعد تغييرها"""
+    catalog = service_registry.cached()
+    if catalog is not None:
+        return catalog
+    return await run_db(service_registry.get)
+
+# البث
+create_broadcast_job_async = to_async(create_broadcast_job)
+get_unfinished_broadcast_jobs_async = to_async(get_unfinished_broadcast_jobs)
+set_broadcast_progress_message_async = to_async(set_broadcast_progress_message)
+get_broadcast_recipients_async = to_async(get_broadcast_recipients)
+save_broadcast_progress_async = to_async(save_broadcast_progress)
+finish_broadcast_job_async = to_async(finish_broadcast_job)
+
+# التخزين الدائم
+load_persistent_data_async = to_async(load_persistent_data)
+save_persistent_data_async = to_async(save_persistent_data)
+delete_persistent_data_async = to_async(delete_persistent_data)
+load_conversation_states_async = to_async(load_conversation_states)
+save_conversation_state_async = to_async(save_conversation_state)
+
+# الملخصات
+get_stats_counters_async = to_async(get_stats_counters)
+export_statistics_to_csv_async = to_async(export_statistics_to_csv)
+get_members_summary_async = to_async(get_members_summary)
+get_deliveries_summary_by_supervisor_async = to_async(get_deliveries_summary_by_supervisor)
+count_supervisor_deliveries_async = to_async(count_supervisor_deliveries)
+get_supervisor_deliveries_by_date_async = to_async(get_supervisor_deliveries_by_date)
+count_service_requests_async = to_async(count_service_requests)
+get_service_statistics_async = to_async(get_service_statistics)
+
+# =========================
+# Persistence
+# =========================
+
+class SQLitePersistence(BasePersistence):
+    """تخزين user_data وchat_data وحالات المحادثات في SQLite لكل مفتاح على حدة.
+
+    لا يُحمّل شيء عند التشغيل؛ تُقرأ بيانات المستخدم عند أول تحديث منه،
+    ولا يُكتب إلا المفتاح الذي تغيرت بياناته فعلاً.
+    """
+
+    def __init__(self, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._loaded: Dict[str, set] = {"user": set(), "chat": set()}
+        # بصمة آخر نسخة محفوظة لكل مفتاح لتجنب إعادة كتابة بيانات لم تتغير
+        self._digests: Dict[Tuple[str, int], bytes] = {}
+
+    @staticmethod
+    def _digest(blob: bytes) -> bytes:
+        return hashlib.blake2b(blob, digest_size=16).digest()
+
+    async def _refresh(self, kind: str, key_id: int, data: Dict):
+        if key_id in self._loaded[kind]:
+            return
+        blob = await load_persistent_data_async(kind, key_id)
+        self._loaded[kind].add(key_id)
+        if blob is not None:
+            self._digests[(kind, key_id)] = self._digest(blob)
+            for key, value in pickle.loads(blob).items():
+                data.setdefault(key, value)
+
+    async def _update(self, kind: str, key_id: int, data: Dict):
+        blob = pickle.dumps(dict(data), protocol=pickle.HIGHEST_PROTOCOL)
+        digest = self._digest(blob)
+        if self._digests.get((kind, key_id)) == digest:
+            return
+        await save_persistent_data_async(kind, key_id, blob)
+        self._digests[(kind, key_id)] = digest
+
+    async def _drop(self, kind: str, key_id: int):
+        await delete_persistent_data_async(kind, key_id)
+        self._digests.pop((kind, key_id), None)
+        self._loaded[kind].discard(key_id)
+
+    # user_data: تحميل كسول عند أول تحديث من المستخدم
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        await self._refresh("user", user_id, user_data)
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        await self._update("user", user_id, data)
+
+    async def drop_user_data(self, user_id: int):
+        await self._drop("user", user_id)
+
+    # chat_data
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        await self._refresh("chat", chat_id, chat_data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        await self._update("chat", chat_id, data)
+
+    async def drop_chat_data(self, chat_id: int):
+        await self._drop("chat", chat_id)
+
+    # حالات المحادثات
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        rows = await load_conversation_states_async(name)
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]):
+        state = pickle.dumps(new_state, protocol=pickle.HIGHEST_PROTOCOL) if new_state is not None else None
+        await save_conversation_state_async(name, json.dumps(list(key)), state)
+
+    # bot_data وcallback_data غير مستخدمة
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def get_callback_data(self):
+        return None
 
-def import_service_requests_from_csv(csv_data: List[Dict]) -> Tuple[int, List]:
-    """استيراد طلبات الخدمات من CSV"""
-    added_count = 0
-    errors = []
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    for i, row in enumerate(csv_data, 1):
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        """كل تحديث يُكتب مباشرة في معاملته، فلا يوجد ما يُفرّغ"""
+
+# =========================
+# Update processing
+# =========================
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """معالجة التحديثات بالتوازي مع الحفاظ على ترتيب تحديثات المحادثة الواحدة.
+
+    تحديثات نفس المحادثة (أو نفس المستخدم للاستعلامات المضمنة) تُنفذ واحداً تلو الآخر
+    بترتيب وصولها، بينما تعمل المحادثات المختلفة معاً بحد أقصى max_running معالجاً.
+    الحد الأقصى في BaseUpdateProcessor يُستخدم لعدد التحديثات المنتظرة، حتى لا تحجز
+    تحديثات محادثة واحدة مشغولة كل أماكن التنفيذ.
+    """
+
+    def __init__(self, max_running: int, max_pending: int):
+        super().__init__(max_concurrent_updates=max(max_pending, max_running))
+        self.max_running = max_running
+        self._running = asyncio.Semaphore(max_running)
+        # مفتاح المحادثة -> (القفل، عدد التحديثات التي تستخدمه)
+        self._locks: Dict[int, List] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine):
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
         try:
-            cursor.execute("""
-                INSERT INTO service_requests (passport, service_name, request_date, requester)
-                VALUES (?, ?, ?, ?)
-            """, (row["passport"], row["service_name"], row["request_date"], row["requester"]))
-            added_count += 1
-        except Exception as e:
-            errors.append(f"الصف {i}: {str(e)}")
-    
-    conn.commit()
-    conn.close()
-    return added_count, errors
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(key, None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
 
 # =========================
 # Keyboards
 # =========================
 
+class StaticKeyboard(ReplyKeyboardMarkup):
+    """لوحة مفاتيح لا تتغير بعد إنشائها، تحتفظ بنسختها المسلسلة لإعادة استخدامها مع كل رد"""
+
+    __slots__ = ("_payload",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self._payload = None
+
+    def to_dict(self, recursive: bool = True) -> Dict:
+        if not recursive:
+            return super().to_dict(recursive=False)
+        if self._payload is None:
+            with self._unfrozen():
+                self._payload = super().to_dict()
+        # نسخة سطحية حتى لا يغير المستدعي النسخة المخزنة المشتركة بين كل الردود
+        return dict(self._payload)
+
+# لوحات المفاتيح الثابتة: تُبنى مرة واحدة ويعاد استخدام نفس الكائن في كل الردود
+_static_keyboards: List[Callable[[], StaticKeyboard]] = []
+
+def static_keyboard(factory: Callable[[], StaticKeyboard]) -> Callable[[], StaticKeyboard]:
+    """تسجيل دالة لوحة مفاتيح ثابتة وتخزين نتيجتها"""
+    cached = functools.lru_cache(maxsize=None)(factory)
+    _static_keyboards.append(cached)
+    return cached
+
+def warm_keyboards() -> int:
+    """بناء وتسلسل جميع لوحات المفاتيح الثابتة عند بدء التشغيل"""
+    for factory in _static_keyboards:
+        factory().to_dict()
+    return len(_static_keyboards)
+
+@static_keyboard
 def main_menu_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("📝 التسجيل"), KeyboardButton("📌 الخدمات")],
             [KeyboardButton("ℹ️ عن المنصة"), KeyboardButton("📞 تواصل معنا")],
@@ -1022,8 +2713,9 @@ def main_menu_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def admin_login_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("🔑 دخول")],
             [KeyboardButton("❌ إلغاء")],
@@ -1031,8 +2723,9 @@ def admin_login_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def contact_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("📞 الهاتف"), KeyboardButton("✉️ البريد الإلكتروني")],
             [KeyboardButton("📱 واتساب"), KeyboardButton("📘 فيسبوك")],
@@ -1041,18 +2734,21 @@ def contact_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def admin_menu_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("👥 إدارة الحسابات"), KeyboardButton("📊 الإحصائيات")],
             [KeyboardButton("📋 كشوفات التسليم"), KeyboardButton("👷 إدارة الخدمات")],
-            [KeyboardButton("📢 إرسال رسالة للكل"), KeyboardButton("🚪 تسجيل خروج")],
+            [KeyboardButton("📢 إرسال رسالة للكل"), KeyboardButton("🔍 بحث عن عضو")],
+            [KeyboardButton("🚪 تسجيل خروج")],
         ],
         resize_keyboard=True,
     )
 
+@static_keyboard
 def account_management_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("👮 إدارة المشرفين"), KeyboardButton("👥 بيانات المسجلين")],
             [KeyboardButton("🔙 رجوع")],
@@ -1060,35 +2756,40 @@ def account_management_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def manage_members_data_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("⬇️ تنزيل البيانات"), KeyboardButton("🗑️ مسح البيانات")],
             [KeyboardButton("📤 رفع ملف CSV"), KeyboardButton("📊 ملخص المسجلين")],
-            [KeyboardButton("🔙 رجوع")],
+            [KeyboardButton("⚠️ التسجيلات المتعارضة"), KeyboardButton("🔙 رجوع")],
         ],
         resize_keyboard=True,
     )
 
+@static_keyboard
 def upload_csv_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("❌ إلغاء الرفع")],
         ],
         resize_keyboard=True,
     )
 
+@static_keyboard
 def assistant_menu_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
-            [KeyboardButton("📦 تسجيل تسليم"), KeyboardButton("📋 كشوفات التسليم")],
+            [KeyboardButton("📦 تسجيل تسليم"), KeyboardButton("🗂️ تسليم دفعة")],
+            [KeyboardButton("📋 كشوفات التسليم"), KeyboardButton("🔍 بحث عن عضو")],
             [KeyboardButton("🚪 تسجيل خروج")],
         ],
         resize_keyboard=True,
     )
 
+@static_keyboard
 def assistants_management_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("➕ إضافة مشرف"), KeyboardButton("🗑️ حذف مشرف")],
             [KeyboardButton("🔑 تغيير كلمة المرور"), KeyboardButton("📋 كشف المشرفين")],
@@ -1097,18 +2798,31 @@ def assistants_management_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def delivery_reports_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("⬇️ تنزيل الكشوفات"), KeyboardButton("🗑️ حذف الكشوفات")],
             [KeyboardButton("📤 رفع ملف CSV"), KeyboardButton("📊 عرض الملخص")],
+            [KeyboardButton("🗓️ جولات التوزيع"), KeyboardButton("🔙 رجوع")],
+        ],
+        resize_keyboard=True,
+    )
+
+@static_keyboard
+def campaigns_kb():
+    return StaticKeyboard(
+        [
+            [KeyboardButton("🆕 فتح جولة جديدة"), KeyboardButton("🔒 إغلاق الجولة الحالية")],
+            [KeyboardButton("📋 عرض الجولات"), KeyboardButton("📥 تصدير جولة")],
             [KeyboardButton("🔙 رجوع")],
         ],
         resize_keyboard=True,
     )
 
+@static_keyboard
 def assistant_delivery_reports_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("📥 تحميل"), KeyboardButton("📊 ملخص")],
             [KeyboardButton("🔙 رجوع")],
@@ -1116,16 +2830,27 @@ def assistant_delivery_reports_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def confirm_delivery_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("✅ نعم - تأكيد"), KeyboardButton("❌ لا - إلغاء")],
         ],
         resize_keyboard=True,
     )
 
+@static_keyboard
+def confirm_batch_delivery_kb():
+    return StaticKeyboard(
+        [
+            [KeyboardButton("✅ نعم - تسجيل الدفعة"), KeyboardButton("❌ لا - إلغاء")],
+        ],
+        resize_keyboard=True,
+    )
+
+@static_keyboard
 def stats_choice_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("📋 عرض الملخص"), KeyboardButton("📥 تنزيل تقرير CSV")],
             [KeyboardButton("🗑️ حذف الملخص"), KeyboardButton("🔙 رجوع")],
@@ -1133,35 +2858,50 @@ def stats_choice_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def confirm_delete_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [[KeyboardButton("✅ نعم، احذف الكشوفات")],
          [KeyboardButton("❌ لا، إلغاء")]],
         resize_keyboard=True,
     )
 
+@static_keyboard
 def confirm_delete_members_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [[KeyboardButton("✅ نعم، احذف بيانات المسجلين")],
          [KeyboardButton("❌ لا، إلغاء")]],
         resize_keyboard=True,
     )
 
+@static_keyboard
 def confirm_delete_stats_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [[KeyboardButton("✅ نعم، احذف الملخص")],
          [KeyboardButton("❌ لا، إلغاء")]],
         resize_keyboard=True,
     )
 
+@static_keyboard
 def cancel_or_back_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [[KeyboardButton("❌ إلغاء"), KeyboardButton("🔙 رجوع")]], 
         resize_keyboard=True
     )
 
+@static_keyboard
+def member_search_kb():
+    return StaticKeyboard(
+        [
+            [KeyboardButton("➡️ النتائج التالية")],
+            [KeyboardButton("❌ إلغاء"), KeyboardButton("🔙 رجوع")],
+        ],
+        resize_keyboard=True,
+    )
+
+@static_keyboard
 def services_admin_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("➕ إضافة خدمة"), KeyboardButton("📋 عرض الخدمات")],
             [KeyboardButton("🗑️ حذف خدمة"), KeyboardButton("📊 إحصائيات الخدمات")],
@@ -1170,8 +2910,9 @@ def services_admin_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def service_report_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("📄 كشف لخدمة واحدة"), KeyboardButton("📄 كشف لكل الخدمات")],
             [KeyboardButton("📤 رفع ملف CSV"), KeyboardButton("🗑️ حذف كشوف الخدمات")],
@@ -1180,8 +2921,9 @@ def service_report_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def service_delete_report_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [
             [KeyboardButton("🗑️ حذف كشف خدمة واحدة"), KeyboardButton("🗑️ حذف كل الكشوفات")],
             [KeyboardButton("🔙 رجوع")],
@@ -1189,8 +2931,9 @@ def service_delete_report_kb():
         resize_keyboard=True,
     )
 
+@static_keyboard
 def confirm_delete_service_kb():
-    return ReplyKeyboardMarkup(
+    return StaticKeyboard(
         [[KeyboardButton("✅ نعم، احذف كشف الخدمة")],
          [KeyboardButton("❌ لا، إلغاء")]],
         resize_keyboard=True,
@@ -1203,6 +2946,13 @@ def services_menu_kb(services):
     keyboard.append([KeyboardButton("🔙 رجوع")])
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+def campaigns_selection_kb(campaigns):
+    keyboard = []
+    for campaign in campaigns:
+        keyboard.append([KeyboardButton(format_campaign_label(campaign))])
+    keyboard.append([KeyboardButton("🔙 رجوع")])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
 def services_selection_kb(services):
     keyboard = []
     for service in services:
@@ -1214,17 +2964,29 @@ def services_selection_kb(services):
 # Utility functions
 # =========================
 
-def validate_admin_session(context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """التحقق من صحة جلسة الأدمن"""
-    user_type = context.user_data.get("user_type")
-    login_user = context.user_data.get("login_user")
-    if not user_type or not login_user:
+async def validate_admin_session(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """التحقق من صحة جلسة الأدمن من رمز الجلسة دون الرجوع لقاعدة البيانات"""
+    session = session_store.validate(context.user_data.get("session_token"))
+    if session is None:
         return False
-    if user_type == "main_admin":
-        return login_user == ADMIN_USER
-    if user_type == "assistant":
-        return validate_assistant(login_user, context.user_data.get("login_pass", ""))
-    return False
+    username, user_type = session
+    return context.user_data.get("login_user") == username and context.user_data.get("user_type") == user_type
+
+async def start_admin_session(context: ContextTypes.DEFAULT_TYPE, username: str, user_type: str):
+    """إصدار رمز جلسة بعد نجاح الدخول"""
+    context.user_data["session_token"] = await issue_session_async(username, user_type)
+    context.user_data["login_user"] = username
+    context.user_data["user_type"] = user_type
+    context.user_data.pop("login_user_temp", None)
+
+async def end_admin_session(context: ContextTypes.DEFAULT_TYPE):
+    """تسجيل الخروج وإلغاء رمز الجلسة"""
+    token = context.user_data.pop("session_token", None)
+    if token:
+        await revoke_session_async(token)
+    context.user_data.pop("login_user", None)
+    context.user_data.pop("login_pass", None)
+    context.user_data.pop("user_type", None)
 
 def format_phone_number(phone: str) -> str:
     """تنسيق رقم الهاتف لرابط الواتساب"""
@@ -1235,13 +2997,170 @@ def format_phone_number(phone: str) -> str:
         cleaned = '20' + cleaned[1:]
     return cleaned
 
+def format_campaign_label(campaign: Dict) -> str:
+    """نص زر الجولة، ويبدأ بمعرفها ليعاد استخراجه عند الاختيار"""
+    status = "🟢" if campaign["status"] == "open" else "⚪"
+    return f"#{campaign['id']} {status} {campaign['name']}"
+
+def parse_campaign_label(text: str) -> Optional[int]:
+    """استخراج معرف الجولة من نص الزر"""
+    match = re.match(r"#(\d+)\b", text.strip())
+    return int(match.group(1)) if match else None
+
+# =========================
+# Broadcast engine
+# =========================
+
+class TokenBucket:
+    """محدد معدل بسيط: rate رسالة في الثانية مع إمكانية الإيقاف المؤقت عند RetryAfter"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """إيقاف جميع الإرسالات مؤقتاً (طلب تيليجرام الانتظار)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        """انتظار رصيد لإرسال رسالة واحدة"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+_broadcast_tasks: Dict[int, asyncio.Task] = {}
+
+async def _send_broadcast_message(bot, bucket: TokenBucket, chat_id: int, text: str) -> bool:
+    """إرسال رسالة بث واحدة مع احترام RetryAfter وإعادة المحاولة عند أخطاء الشبكة"""
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        await bucket.acquire()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return True
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+            logger.warning(f"Broadcast rate limited, pausing for {seconds}s")
+            bucket.pause(seconds)
+        except (Forbidden, BadRequest) as e:
+            logger.info(f"Broadcast to {chat_id} rejected: {e}")
+            return False
+        except NetworkError as e:
+            logger.warning(f"Broadcast to {chat_id} failed (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+        except TelegramError as e:
+            logger.error(f"Failed to send message to {chat_id}: {e}")
+            return False
+    return False
+
+async def _report_broadcast_progress(bot, job: Dict, sent: int, failed: int, done: bool):
+    """تحديث رسالة التقدم لدى الأدمن"""
+    if done:
+        text = (
+            f"✅ تم إرسال الرسالة:\n"
+            f"✅ نجح: {sent}\n"
+            f"❌ فشل: {failed}"
+        )
+    else:
+        text = (
+            f"📢 جاري إرسال الرسالة...\n"
+            f"✅ نجح: {sent}\n"
+            f"❌ فشل: {failed}\n"
+            f"📋 من أصل: {job['total']}"
+        )
+    try:
+        if job.get("progress_message_id"):
+            await bot.edit_message_text(chat_id=job["admin_chat_id"], message_id=job["progress_message_id"], text=text)
+        elif done:
+            await bot.send_message(chat_id=job["admin_chat_id"], text=text)
+    except TelegramError as e:
+        logger.warning(f"Could not update broadcast progress for job {job['id']}: {e}")
+
+async def run_broadcast_job(bot, job: Dict):
+    """تنفيذ مهمة البث على دفعات من المؤشر المحفوظ، وحفظ التقدم بعد كل دفعة"""
+    bucket = TokenBucket(BROADCAST_RATE_PER_SECOND)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    cursor = job["last_user_row_id"]
+    sent = job["sent"]
+    failed = job["failed"]
+    last_report = time.monotonic()
+    
+    async def send(chat_id: int) -> bool:
+        async with semaphore:
+            return await _send_broadcast_message(bot, bucket, chat_id, job["message"])
+    
+    while True:
+        recipients = await get_broadcast_recipients_async(cursor, BROADCAST_BATCH_SIZE)
+        if not recipients:
+            break
+        
+        results = await asyncio.gather(*(send(user_id) for _, user_id in recipients))
+        sent += sum(results)
+        failed += len(results) - sum(results)
+        cursor = recipients[-1][0]
+        await save_broadcast_progress_async(job["id"], cursor, sent, failed)
+        
+        if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+            await _report_broadcast_progress(bot, job, sent, failed, done=False)
+            last_report = time.monotonic()
+    
+    await finish_broadcast_job_async(job["id"])
+    await _report_broadcast_progress(bot, job, sent, failed, done=True)
+    logger.info(f"Broadcast job {job['id']} finished: {sent} sent, {failed} failed")
+
+def start_broadcast_job(bot, job: Dict) -> asyncio.Task:
+    """تشغيل مهمة البث في الخلفية دون حجز محادثة الأدمن"""
+    async def runner():
+        try:
+            await run_broadcast_job(bot, job)
+        except asyncio.CancelledError:
+            logger.info(f"Broadcast job {job['id']} interrupted; it will resume on next start")
+            raise
+        except Exception:
+            logger.exception(f"Broadcast job {job['id']} failed; it will resume on next start")
+        finally:
+            _broadcast_tasks.pop(job["id"], None)
+    
+    task = asyncio.create_task(runner(), name=f"broadcast-{job['id']}")
+    _broadcast_tasks[job["id"]] = task
+    return task
+
+async def resume_broadcast_jobs(bot):
+    """استئناف مهام البث غير المكتملة من آخر مؤشر محفوظ"""
+    for job in await get_unfinished_broadcast_jobs_async():
+        if job["id"] not in _broadcast_tasks:
+            logger.info(f"Resuming broadcast job {job['id']} after user row {job['last_user_row_id']}")
+            start_broadcast_job(bot, job)
+
+async def stop_broadcast_jobs():
+    """إيقاف مهام البث الجارية (يحفظ المؤشر بعد كل دفعة فتستأنف لاحقاً)"""
+    tasks = list(_broadcast_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 # =========================
 # Handlers
 # =========================
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    add_user_if_not_exists(user.id, user.username or "")
+    await add_user_if_not_exists_async(user.id, user.username or "")
     
     welcome_message = (
         "مرحباً بك في منصة الجالية السودانية بأسوان 🇸🇩\n\n"
@@ -1323,7 +3242,7 @@ async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await go_main_menu(update, context)
         return ConversationHandler.END
     
-    if is_passport_registered(passport):
+    if await is_passport_registered_async(passport):
         await update.message.reply_text(
             "⚠️ أنت مسجل بالفعل في النظام.\n"
             "يمكنك استخدام قائمة الخدمات لطلب خدمات أخرى.",
@@ -1399,7 +3318,7 @@ async def confirm_registration(update: Update, context: ContextTypes.DEFAULT_TYP
     address = context.user_data.get("address")
     role = context.user_data.get("role")
     
-    if add_member(name, passport, phone, address, role, family_count):
+    if await add_member_async(name, passport, phone, address, role, family_count):
         await update.message.reply_text(
             "✅ تم تسجيل بياناتك بنجاح!\n"
             "شكراً لانضمامك إلى منصة الجالية السودانية بأسوان.",
@@ -1446,15 +3365,19 @@ async def admin_get_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     
     if username == ADMIN_USER and password == ADMIN_PASS:
-        context.user_data["login_user"] = username
-        context.user_data["user_type"] = "main_admin"
+        await start_admin_session(context, username, "main_admin")
         await update.message.reply_text("✅ تم الدخول كمسؤول رئيسي.", reply_markup=admin_menu_kb())
+        conflicts = await count_member_conflicts_async(unreported_only=True)
+        if conflicts:
+            await update.message.reply_text(
+                f"⚠️ يوجد {conflicts} تسجيل بنفس رقم جواز عضو آخر (بعد توحيد صيغة الجواز) فصلت عن بيانات المسجلين.\n"
+                "حملها للمراجعة من: 👥 إدارة الحسابات ← 👥 بيانات المسجلين ← ⚠️ التسجيلات المتعارضة",
+                reply_markup=admin_menu_kb()
+            )
         return States.ADMIN_MENU
     
-    if validate_assistant(username, password):
-        context.user_data["login_user"] = username
-        context.user_data["login_pass"] = password
-        context.user_data["user_type"] = "assistant"
+    if await validate_assistant_async(username, password):
+        await start_admin_session(context, username, "assistant")
         await update.message.reply_text("✅ تم الدخول كمشرف.", reply_markup=assistant_menu_kb())
         return States.ASSISTANT_MENU
     
@@ -1462,7 +3385,7 @@ async def admin_get_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context):
+    if not await validate_admin_session(context):
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
@@ -1507,22 +3430,55 @@ async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     elif text == "📦 تسجيل تسليم":
         if user_type == "assistant":
-            await update.message.reply_text("🛂 أدخل رقم جواز العضو:", reply_markup=cancel_or_back_kb())
+            if not await get_active_campaign_async():
+                await update.message.reply_text(
+                    "⚠️ لا توجد جولة توزيع مفتوحة حالياً. يرجى مراجعة الإدارة.",
+                    reply_markup=assistant_menu_kb()
+                )
+                return States.ASSISTANT_MENU
+            await update.message.reply_text(
+                "🛂 أدخل رقم جواز العضو:\n"
+                f"أو ابحث عنه بكتابة @{context.bot.username} ثم بداية رقم الجواز أو الاسم.",
+                reply_markup=cancel_or_back_kb()
+            )
             return States.RECORD_DELIVERY_PASSPORT
         else:
             await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=admin_menu_kb())
     
+    elif text == "🗂️ تسليم دفعة":
+        if user_type == "assistant":
+            if not await get_active_campaign_async():
+                await update.message.reply_text(
+                    "⚠️ لا توجد جولة توزيع مفتوحة حالياً. يرجى مراجعة الإدارة.",
+                    reply_markup=assistant_menu_kb()
+                )
+                return States.ASSISTANT_MENU
+            await update.message.reply_text(
+                "🗂️ الصق أرقام الجوازات (رقم في كل سطر)\n"
+                "أو أرسل ملف CSV يحتوي على عمود رقم_الجواز.\n\n"
+                f"الحد الأقصى: {BATCH_DELIVERY_MAX_SIZE} جواز في الدفعة.",
+                reply_markup=cancel_or_back_kb()
+            )
+            return States.BATCH_DELIVERY_INPUT
+        else:
+            await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=admin_menu_kb())
+    
+    elif text == "🔍 بحث عن عضو":
+        await update.message.reply_text(
+            "🔍 أدخل الاسم أو رقم الهاتف أو العنوان أو الصفة للبحث:",
+            reply_markup=cancel_or_back_kb()
+        )
+        return States.SEARCH_MEMBERS
+    
     elif text == "🚪 تسجيل خروج":
-        context.user_data.pop("login_user", None)
-        context.user_data.pop("login_pass", None)
-        context.user_data.pop("user_type", None)
+        await end_admin_session(context)
         await update.message.reply_text("🚪 تم تسجيل الخروج.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
     return States.ADMIN_MENU if user_type == "main_admin" else States.ASSISTANT_MENU
 
 async def account_management_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
@@ -1543,7 +3499,7 @@ async def account_management_handler(update: Update, context: ContextTypes.DEFAU
     return States.ACCOUNT_MANAGEMENT
 
 async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
@@ -1552,24 +3508,20 @@ async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ تم إلغاء الإرسال.", reply_markup=admin_menu_kb())
         return States.ADMIN_MENU
     
-    users = get_all_users()
-    success = 0
-    failed = 0
-    
-    for user in users:
-        try:
-            await context.bot.send_message(chat_id=user["user_id"], text=message)
-            success += 1
-        except Exception as e:
-            logger.error(f"Failed to send message to {user['user_id']}: {e}")
-            failed += 1
-    
+    job = await create_broadcast_job_async(message, update.effective_chat.id)
     await update.message.reply_text(
-        f"✅ تم إرسال الرسالة:\n"
-        f"✅ نجح: {success}\n"
-        f"❌ فشل: {failed}",
+        "📢 بدأ إرسال الرسالة للجميع في الخلفية.\n"
+        "يمكنك متابعة استخدام البوت، وسيتم تحديث حالة الإرسال أدناه.",
         reply_markup=admin_menu_kb()
     )
+    progress = await update.message.reply_text(
+        f"📢 جاري إرسال الرسالة...\n"
+        f"📋 من أصل: {job['total']}"
+    )
+    job["progress_message_id"] = progress.message_id
+    await set_broadcast_progress_message_async(job["id"], progress.message_id)
+    
+    start_broadcast_job(context.bot, job)
     return States.ADMIN_MENU
 
 # =========================
@@ -1577,25 +3529,24 @@ async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =========================
 
 async def manage_members_data_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
         await update.message.reply_text("⚠️ ليس لديك صلاحيات الوصول.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
     text = update.message.text
     
     if text == "⬇️ تنزيل البيانات":
-        members = get_all_members()
-        if not members:
+        counters = await get_stats_counters_async()
+        if not counters["members"]:
             await update.message.reply_text("⚠️ لا توجد بيانات مسجلين حتى الآن.", reply_markup=manage_members_data_kb())
             return States.MANAGE_MEMBERS_DATA
         
-        filename = export_members_to_csv()
-        await update.message.reply_document(
-            document=open(filename, "rb"),
-            filename="members.csv",
-            caption="📥 بيانات المسجلين"
-        )
-        os.remove(filename)
+        with await export_members_to_csv_async() as export_file:
+            await update.message.reply_document(
+                document=export_file,
+                filename="members.csv",
+                caption="📥 بيانات المسجلين"
+            )
         return States.MANAGE_MEMBERS_DATA
     
     elif text == "🗑️ مسح البيانات":
@@ -1617,29 +3568,38 @@ async def manage_members_data_menu(update: Update, context: ContextTypes.DEFAULT
         return States.UPLOAD_MEMBERS_CSV_FILE
     
     elif text == "📊 ملخص المسجلين":
-        members = get_all_members()
-        if not members:
+        summary = await get_members_summary_async()
+        if not summary["total"]:
             await update.message.reply_text("⚠️ لا توجد بيانات مسجلين حتى الآن.", reply_markup=manage_members_data_kb())
             return States.MANAGE_MEMBERS_DATA
         
-        total = len(members)
-        total_family_members = sum(member["family_members"] for member in members)
-        
-        roles = {}
-        for member in members:
-            role = member.get("role", "غير محدد")
-            roles[role] = roles.get(role, 0) + 1
-        
         report = f"📊 ملخص المسجلين:\n\n"
-        report += f"إجمالي المسجلين: {total}\n"
-        report += f"إجمالي أفراد الأسر: {total_family_members}\n\n"
+        report += f"إجمالي المسجلين: {summary['total']}\n"
+        report += f"إجمالي أفراد الأسر: {summary['total_family_members']}\n\n"
         report += f"التوزيع حسب الصفة:\n"
-        for role, count in roles.items():
+        for role, count in summary["roles"]:
             report += f"- {role}: {count}\n"
         
         await update.message.reply_text(report, reply_markup=manage_members_data_kb())
         return States.MANAGE_MEMBERS_DATA
     
+    elif text == "⚠️ التسجيلات المتعارضة":
+        if not await count_member_conflicts_async():
+            await update.message.reply_text("✅ لا توجد تسجيلات متعارضة.", reply_markup=manage_members_data_kb())
+            return States.MANAGE_MEMBERS_DATA
+        
+        with await export_member_conflicts_to_csv_async() as export_file:
+            await update.message.reply_document(
+                document=export_file,
+                filename="members_passport_conflicts.csv",
+                caption=(
+                    "⚠️ تسجيلات بنفس رقم الجواز بعد توحيد صيغته، فصلت عن بيانات المسجلين.\n"
+                    "راجعها وأعد رفع الصحيح منها عبر '📤 رفع ملف CSV'."
+                )
+            )
+        await mark_member_conflicts_exported_async()
+        return States.MANAGE_MEMBERS_DATA
+    
     elif text == "🔙 رجوع":
         await update.message.reply_text("⬅️ رجعت لقائمة إدارة الحسابات.", reply_markup=account_management_kb())
         return States.ACCOUNT_MANAGEMENT
@@ -1655,7 +3615,7 @@ async def handle_members_csv_upload(update: Update, context: ContextTypes.DEFAUL
         file_path = os.path.join(TEMP_CSV_DIR, f"members_upload_{update.update_id}.csv")
         await file.download_to_drive(file_path)
         
-        is_valid, message, csv_data = validate_members_csv(file_path)
+        is_valid, message, _ = await validate_members_csv_async(file_path)
         
         if not is_valid:
             os.remove(file_path)
@@ -1665,7 +3625,7 @@ async def handle_members_csv_upload(update: Update, context: ContextTypes.DEFAUL
             )
             return States.MANAGE_MEMBERS_DATA
         
-        added_count, updated_count, errors = import_members_from_csv(csv_data)
+        added_count, updated_count, errors = await import_members_from_csv_async(iter_members_csv(file_path))
         
         os.remove(file_path)
         
@@ -1697,7 +3657,7 @@ async def handle_members_csv_upload(update: Update, context: ContextTypes.DEFAUL
 
 async def admin_clear_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text == "✅ نعم، احذف بيانات المسجلين":
-        if delete_all_members():
+        if await delete_all_members_async():
             await update.message.reply_text("🗑️ تم مسح جميع بيانات المسجلين.", reply_markup=manage_members_data_kb())
         else:
             await update.message.reply_text("❌ حدث خطأ في حذف البيانات.", reply_markup=manage_members_data_kb())
@@ -1710,7 +3670,7 @@ async def admin_clear_members(update: Update, context: ContextTypes.DEFAULT_TYPE
 # =========================
 
 async def manage_services_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
         await update.message.reply_text("⚠️ ليس لديك صلاحيات للوصول لإدارة الخدمات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
@@ -1721,51 +3681,43 @@ async def manage_services_menu(update: Update, context: ContextTypes.DEFAULT_TYP
         return States.ADD_SERVICE
     
     elif text == "📋 عرض الخدمات":
-        services = get_services_from_db()
-        if not services:
+        catalog = await get_service_catalog()
+        if not catalog:
             await update.message.reply_text("⚠️ لا توجد خدمات مضافة.", reply_markup=services_admin_kb())
             return States.MANAGE_SERVICES
         
         report = "📋 قائمة الخدمات:\n\n"
-        for i, service in enumerate(services, 1):
+        for i, service in enumerate(catalog.services, 1):
             report += f"{i}. {service['service_name']}\n"
         
         await update.message.reply_text(report, reply_markup=services_admin_kb())
         return States.MANAGE_SERVICES
     
     elif text == "🗑️ حذف خدمة":
-        services = get_services_from_db()
-        if not services:
+        catalog = await get_service_catalog()
+        if not catalog:
             await update.message.reply_text("⚠️ لا توجد خدمات مضافة.", reply_markup=services_admin_kb())
             return States.MANAGE_SERVICES
         
-        keyboard = [[KeyboardButton(s["service_name"])] for s in services]
-        keyboard.append([KeyboardButton("🔙 رجوع")])
-        await update.message.reply_text(
-            "📋 اختر الخدمة للحذف:",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        )
+        await update.message.reply_text("📋 اختر الخدمة للحذف:", reply_markup=catalog.selection_kb)
         return States.DELETE_SERVICE
     
     elif text == "📊 إحصائيات الخدمات":
-        services_stats = get_service_statistics()
-        services = get_services_from_db()
+        services_stats = await get_service_statistics_async()
         
-        if not services:
+        if not services_stats:
             await update.message.reply_text("⚠️ لا توجد خدمات مضافة.", reply_markup=services_admin_kb())
             return States.MANAGE_SERVICES
         
         report = "📊 إحصائيات الخدمات:\n\n"
         total_requests = 0
         
-        for service in services:
-            service_name = service["service_name"]
-            requests_count = services_stats.get(service_name, 0)
+        for service_name, requests_count in services_stats.items():
             total_requests += requests_count
             report += f"🔹 {service_name}: {requests_count} طلب\n"
         
         report += f"\n📋 إجمالي الطلبات: {total_requests}\n"
-        report += f"🛠️ إجمالي الخدمات: {len(services)}"
+        report += f"🛠️ إجمالي الخدمات: {len(services_stats)}"
         
         await update.message.reply_text(report, reply_markup=services_admin_kb())
         return States.MANAGE_SERVICES
@@ -1781,7 +3733,7 @@ async def manage_services_menu(update: Update, context: ContextTypes.DEFAULT_TYP
     return States.MANAGE_SERVICES
 
 async def admin_add_service_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context):
+    if not await validate_admin_session(context):
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
@@ -1790,7 +3742,7 @@ async def admin_add_service_start(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text("⬅️ رجعت لقائمة إدارة الخدمات.", reply_markup=services_admin_kb())
         return States.MANAGE_SERVICES
     
-    if add_service_to_db(service_name):
+    if await add_service_to_db_async(service_name):
         await update.message.reply_text(
             f"✅ تم إضافة خدمة {service_name} بنجاح.",
             reply_markup=services_admin_kb()
@@ -1801,8 +3753,7 @@ async def admin_add_service_start(update: Update, context: ContextTypes.DEFAULT_
     return States.MANAGE_SERVICES
 
 async def admin_delete_service_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    services = get_services_from_db()
-    if not services:
+    if not await get_service_catalog():
         await update.message.reply_text("⚠️ لا توجد خدمات لحذفها.", reply_markup=services_admin_kb())
         return States.MANAGE_SERVICES
     
@@ -1811,7 +3762,7 @@ async def admin_delete_service_start(update: Update, context: ContextTypes.DEFAU
         await update.message.reply_text("⬅️ رجعت لقائمة إدارة الخدمات.", reply_markup=services_admin_kb())
         return States.MANAGE_SERVICES
     
-    if delete_service_from_db(selected):
+    if await delete_service_from_db_async(selected):
         await update.message.reply_text(
             f"✅ تم حذف خدمة {selected} بنجاح.",
             reply_markup=services_admin_kb()
@@ -1823,34 +3774,33 @@ async def admin_delete_service_start(update: Update, context: ContextTypes.DEFAU
 
 # معالجة كشوفات الخدمات
 async def service_report_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
     text = update.message.text
     
     if text == "📄 كشف لخدمة واحدة":
-        services = get_services_from_db()
-        if not services:
+        catalog = await get_service_catalog()
+        if not catalog:
             await update.message.reply_text("⚠️ لا توجد خدمات مضافة.", reply_markup=service_report_kb())
             return States.SERVICE_REPORT
         
-        await update.message.reply_text("📋 اختر الخدمة للحصول على كشفها:", reply_markup=services_selection_kb(services))
+        await update.message.reply_text("📋 اختر الخدمة للحصول على كشفها:", reply_markup=catalog.selection_kb)
         return States.SELECT_SERVICE_FOR_REPORT
     
     elif text == "📄 كشف لكل الخدمات":
-        requests = get_service_requests_from_db()
-        if not requests:
+        counters = await get_stats_counters_async()
+        if not counters["service_requests"]:
             await update.message.reply_text("⚠️ لا توجد طلبات خدمات حتى الآن.", reply_markup=service_report_kb())
             return States.SERVICE_REPORT
         
-        filename = export_service_requests_to_csv()
-        await update.message.reply_document(
-            document=open(filename, "rb"),
-            filename="all_services_report.csv",
-            caption="📄 كشف جميع طلبات الخدمات"
-        )
-        os.remove(filename)
+        with await export_service_requests_to_csv_async() as export_file:
+            await update.message.reply_document(
+                document=export_file,
+                filename="all_services_report.csv",
+                caption="📄 كشف جميع طلبات الخدمات"
+            )
         return States.SERVICE_REPORT
     
     elif text == "📤 رفع ملف CSV":
@@ -1881,7 +3831,7 @@ async def handle_services_csv_upload(update: Update, context: ContextTypes.DEFAU
         file_path = os.path.join(TEMP_CSV_DIR, f"services_upload_{update.update_id}.csv")
         await file.download_to_drive(file_path)
         
-        is_valid, message, csv_data = validate_service_requests_csv(file_path)
+        is_valid, message, _ = await validate_service_requests_csv_async(file_path)
         
         if not is_valid:
             os.remove(file_path)
@@ -1891,13 +3841,15 @@ async def handle_services_csv_upload(update: Update, context: ContextTypes.DEFAU
             )
             return States.SERVICE_REPORT
         
-        added_count, errors = import_service_requests_from_csv(csv_data)
+        added_count, skipped_count, errors = await import_service_requests_from_csv_async(iter_service_requests_csv(file_path))
         
         os.remove(file_path)
         
         result_message = f"✅ تم رفع البيانات بنجاح!\n\n"
         result_message += f"📊 النتائج:\n"
         result_message += f"• عدد الطلبات المضافة: {added_count}\n"
+        if skipped_count:
+            result_message += f"• طلبات مكررة تم تجاهلها: {skipped_count}\n"
         
         if errors:
             result_message += f"\n⚠️ ملاحظات:\n"
@@ -1926,26 +3878,24 @@ async def select_service_for_report_handler(update: Update, context: ContextType
         await update.message.reply_text("📄 اختر نوع الكشف:", reply_markup=service_report_kb())
         return States.SERVICE_REPORT
     
-    services = get_services_from_db()
-    service_names = [s["service_name"] for s in services]
+    catalog = await get_service_catalog()
     
-    if selected_service not in service_names:
-        await update.message.reply_text("⚠️ الخدمة المختارة غير صحيحة.", reply_markup=services_selection_kb(services))
+    if selected_service not in catalog:
+        await update.message.reply_text("⚠️ الخدمة المختارة غير صحيحة.", reply_markup=catalog.selection_kb)
         return States.SELECT_SERVICE_FOR_REPORT
     
-    requests = get_service_requests_by_service(selected_service)
-    if not requests:
+    requests_count = await count_service_requests_async(selected_service)
+    if not requests_count:
         await update.message.reply_text(f"⚠️ لا توجد طلبات لخدمة {selected_service} حتى الآن.", reply_markup=service_report_kb())
         return States.SERVICE_REPORT
     
-    filename = export_service_requests_to_csv(selected_service)
-    await update.message.reply_document(
-        document=open(filename, "rb"),
-        filename=f"{selected_service}_report.csv",
-        caption=f"📄 كشف طلبات خدمة {selected_service}\n"
-                f"📊 إجمالي الطلبات: {len(requests)}"
-    )
-    os.remove(filename)
+    with await export_service_requests_to_csv_async(selected_service) as export_file:
+        await update.message.reply_document(
+            document=export_file,
+            filename=f"{selected_service}_report.csv",
+            caption=f"📄 كشف طلبات خدمة {selected_service}\n"
+                    f"📊 إجمالي الطلبات: {requests_count}"
+        )
     
     await update.message.reply_text("📄 اختر نوع الكشف:", reply_markup=service_report_kb())
     return States.SERVICE_REPORT
@@ -1955,12 +3905,12 @@ async def delete_service_report_handler(update: Update, context: ContextTypes.DE
     text = update.message.text
     
     if text == "🗑️ حذف كشف خدمة واحدة":
-        services = get_services_from_db()
-        if not services:
+        catalog = await get_service_catalog()
+        if not catalog:
             await update.message.reply_text("⚠️ لا توجد خدمات مضافة.", reply_markup=service_delete_report_kb())
             return States.DELETE_SERVICE_REPORT
         
-        await update.message.reply_text("📋 اختر الخدمة لحذف كشفها:", reply_markup=services_selection_kb(services))
+        await update.message.reply_text("📋 اختر الخدمة لحذف كشفها:", reply_markup=catalog.selection_kb)
         return States.SELECT_SERVICE_FOR_DELETE
     
     elif text == "🗑️ حذف كل الكشوفات":
@@ -1984,11 +3934,10 @@ async def select_service_for_delete_handler(update: Update, context: ContextType
         await update.message.reply_text("🗑️ اختر نوع الحذف:", reply_markup=service_delete_report_kb())
         return States.DELETE_SERVICE_REPORT
     
-    services = get_services_from_db()
-    service_names = [s["service_name"] for s in services]
+    catalog = await get_service_catalog()
     
-    if selected_service not in service_names:
-        await update.message.reply_text("⚠️ الخدمة المختارة غير صحيحة.", reply_markup=services_selection_kb(services))
+    if selected_service not in catalog:
+        await update.message.reply_text("⚠️ الخدمة المختارة غير صحيحة.", reply_markup=catalog.selection_kb)
         return States.SELECT_SERVICE_FOR_DELETE
     
     context.user_data["service_to_delete"] = selected_service
@@ -2006,7 +3955,7 @@ async def confirm_delete_single_service_handler(update: Update, context: Context
     if text == "✅ نعم، احذف كشف الخدمة":
         service_name = context.user_data.get("service_to_delete")
         
-        if delete_service_requests_by_service(service_name):
+        if await delete_service_requests_by_service_async(service_name):
             await update.message.reply_text(
                 f"✅ تم حذف كشف خدمة {service_name} بنجاح.",
                 reply_markup=service_delete_report_kb()
@@ -2027,7 +3976,7 @@ async def confirm_delete_all_services_handler(update: Update, context: ContextTy
     text = update.message.text
     
     if text == "✅ نعم، احذف الكشوفات":
-        if delete_all_service_requests():
+        if await delete_all_service_requests_async():
             await update.message.reply_text(
                 "✅ تم حذف جميع كشوفات الخدمات بنجاح.",
                 reply_markup=service_delete_report_kb()
@@ -2047,12 +3996,12 @@ async def confirm_delete_all_services_handler(update: Update, context: ContextTy
 # =========================
 
 async def services_menu_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    services = get_services_from_db()
-    if not services:
+    catalog = await get_service_catalog()
+    if not catalog:
         await update.message.reply_text("⚠️ لا توجد خدمات مضافة حالياً. يرجى مراجعة الإدارة.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
-    await update.message.reply_text("📌 اختر الخدمة المطلوبة:", reply_markup=services_menu_kb(services))
+    await update.message.reply_text("📌 اختر الخدمة المطلوبة:", reply_markup=catalog.menu_kb)
     return States.SERVICES_MENU
 
 async def services_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2061,11 +4010,10 @@ async def services_menu_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await go_main_menu(update, context)
         return ConversationHandler.END
     
-    services = get_services_from_db()
-    service_names = [s["service_name"] for s in services]
+    catalog = await get_service_catalog()
     
-    if choice not in service_names:
-        await update.message.reply_text("⚠️ الخدمة المختارة غير صحيحة. يرجى الاختيار من القائمة.", reply_markup=services_menu_kb(services))
+    if choice not in catalog:
+        await update.message.reply_text("⚠️ الخدمة المختارة غير صحيحة. يرجى الاختيار من القائمة.", reply_markup=catalog.menu_kb)
         return States.SERVICES_MENU
     
     context.user_data["selected_service"] = choice
@@ -2085,7 +4033,7 @@ async def service_enter_passport(update: Update, context: ContextTypes.DEFAULT_T
     
     service_name = context.user_data.get("selected_service")
     
-    member = get_member_by_passport(passport)
+    member = await get_member_by_passport_async(passport)
     
     if not member:
         await update.message.reply_text(
@@ -2096,7 +4044,8 @@ async def service_enter_passport(update: Update, context: ContextTypes.DEFAULT_T
         context.user_data.clear()
         return ConversationHandler.END
     
-    if check_existing_service_request(passport, service_name):
+    # الإضافة والتحقق من الطلب المسبق في عبارة واحدة يحميها قيد التفرد
+    if not await request_service_async(passport, service_name):
         await update.message.reply_text(
             f"⚠️ لقد طلبت خدمة {service_name} مسبقاً.\n"
             "لا يمكنك طلب نفس الخدمة مرة أخرى.",
@@ -2105,9 +4054,6 @@ async def service_enter_passport(update: Update, context: ContextTypes.DEFAULT_T
         context.user_data.clear()
         return ConversationHandler.END
     
-    requester = member.get("name", "غير مسجل")
-    add_service_request(passport, service_name, requester)
-    
     await update.message.reply_text(
         f"✅ تم تقديم طلب {service_name} بنجاح.\n"
         "شكراً لاستخدامك منصة الجالية السودانية بأسوان.",
@@ -2122,62 +4068,35 @@ async def service_enter_passport(update: Update, context: ContextTypes.DEFAULT_T
 # =========================
 
 async def admin_stats_choice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
     text = update.message.text
     
     if text == "📋 عرض الملخص":
-        members = get_all_members()
-        deliveries = get_all_deliveries()
-        users = get_all_users()
-        assistants = get_all_assistants()
-        service_requests = get_service_requests_from_db()
-        
-        total_family_members = sum(member["family_members"] for member in members)
+        counters = await get_stats_counters_async()
         
         report = (
             f"📊 الإحصائيات العامة:\n\n"
-            f"👥 إجمالي المسجلين: {len(members)}\n"
-            f"👨‍👩‍👧‍👦 إجمالي أفراد الأسر: {total_family_members}\n"
-            f"📦 إجمالي التسليمات: {len(deliveries)}\n"
-            f"👤 إجمالي المستخدمين: {len(users)}\n"
-            f"👮 إجمالي المشرفين: {len(assistants)}\n"
-            f"📋 إجمالي طلبات الخدمات: {len(service_requests)}\n"
+            f"👥 إجمالي المسجلين: {counters['members']}\n"
+            f"👨‍👩‍👧‍👦 إجمالي أفراد الأسر: {counters['family_members']}\n"
+            f"📦 إجمالي التسليمات: {counters['deliveries']}\n"
+            f"👤 إجمالي المستخدمين: {counters['users']}\n"
+            f"👮 إجمالي المشرفين: {counters['assistants']}\n"
+            f"📋 إجمالي طلبات الخدمات: {counters['service_requests']}\n"
         )
         
         await update.message.reply_text(report, reply_markup=stats_choice_kb())
         return States.STATS_MENU
     
     elif text == "📥 تنزيل تقرير CSV":
-        members = get_all_members()
-        deliveries = get_all_deliveries()
-        users = get_all_users()
-        assistants = get_all_assistants()
-        service_requests = get_service_requests_from_db()
-        
-        total_family_members = sum(member["family_members"] for member in members)
-        
-        os.makedirs(TEMP_CSV_DIR, exist_ok=True)
-        stats_filename = os.path.join(TEMP_CSV_DIR, "statistics_report.csv")
-        
-        with open(stats_filename, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["نوع الإحصائية", "العدد"])
-            writer.writerow(["إجمالي المسجلين", len(members)])
-            writer.writerow(["إجمالي أفراد الأسر", total_family_members])
-            writer.writerow(["إجمالي التسليمات", len(deliveries)])
-            writer.writerow(["إجمالي المستخدمين", len(users)])
-            writer.writerow(["إجمالي المشرفين", len(assistants)])
-            writer.writerow(["إجمالي طلبات الخدمات", len(service_requests)])
-        
-        await update.message.reply_document(
-            document=open(stats_filename, "rb"),
-            filename="statistics_report.csv",
-            caption="📊 تقرير الإحصائيات"
-        )
-        os.remove(stats_filename)
+        with await export_statistics_to_csv_async() as export_file:
+            await update.message.reply_document(
+                document=export_file,
+                filename="statistics_report.csv",
+                caption="📊 تقرير الإحصائيات"
+            )
         return States.STATS_MENU
     
     elif text == "🗑️ حذف الملخص":
@@ -2197,9 +4116,9 @@ async def admin_stats_choice_handler(update: Update, context: ContextTypes.DEFAU
 async def admin_delete_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text == "✅ نعم، احذف الملخص":
         success = True
-        if not delete_all_deliveries():
+        if not await delete_all_deliveries_async():
             success = False
-        if not delete_all_service_requests():
+        if not await delete_all_service_requests_async():
             success = False
         
         if success:
@@ -2215,7 +4134,7 @@ async def admin_delete_stats(update: Update, context: ContextTypes.DEFAULT_TYPE)
 # =========================
 
 async def manage_assistants_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
@@ -2226,7 +4145,7 @@ async def manage_assistants_menu(update: Update, context: ContextTypes.DEFAULT_T
         return States.CREATE_ASSISTANT_USER
     
     elif text == "🗑️ حذف مشرف":
-        assistants = get_all_assistants()
+        assistants = await get_all_assistants_async()
         if not assistants:
             await update.message.reply_text("⚠️ لا يوجد مشرفين مسجلين.", reply_markup=assistants_management_kb())
             return States.MANAGE_ASSISTANTS
@@ -2240,7 +4159,7 @@ async def manage_assistants_menu(update: Update, context: ContextTypes.DEFAULT_T
         return States.DELETE_ASSISTANT
     
     elif text == "🔑 تغيير كلمة المرور":
-        assistants = get_all_assistants()
+        assistants = await get_all_assistants_async()
         if not assistants:
             await update.message.reply_text("⚠️ لا يوجد مشرفين مسجلين.", reply_markup=assistants_management_kb())
             return States.MANAGE_ASSISTANTS
@@ -2254,7 +4173,7 @@ async def manage_assistants_menu(update: Update, context: ContextTypes.DEFAULT_T
         return States.CHANGE_ASSISTANT_USER
     
     elif text == "📋 كشف المشرفين":
-        assistants = get_all_assistants()
+        assistants = await get_all_assistants_async()
         if not assistants:
             await update.message.reply_text("⚠️ لا يوجد مشرفين مسجلين.", reply_markup=assistants_management_kb())
             return States.MANAGE_ASSISTANTS
@@ -2267,18 +4186,17 @@ async def manage_assistants_menu(update: Update, context: ContextTypes.DEFAULT_T
         return States.MANAGE_ASSISTANTS
     
     elif text == "📥 تنزيل قائمة المشرفين":
-        assistants = get_all_assistants()
+        assistants = await get_all_assistants_async()
         if not assistants:
             await update.message.reply_text("⚠️ لا يوجد مشرفين مسجلين.", reply_markup=assistants_management_kb())
             return States.MANAGE_ASSISTANTS
         
-        filename = export_assistants_to_csv()
-        await update.message.reply_document(
-            document=open(filename, "rb"),
-            filename="assistants.csv",
-            caption="📥 قائمة المشرفين"
-        )
-        os.remove(filename)
+        with await export_assistants_to_csv_async() as export_file:
+            await update.message.reply_document(
+                document=export_file,
+                filename="assistants.csv",
+                caption="📥 قائمة المشرفين"
+            )
         return States.MANAGE_ASSISTANTS
     
     elif text == "🔙 رجوع":
@@ -2293,7 +4211,7 @@ async def create_assistant_user(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("تم الإلغاء.", reply_markup=assistants_management_kb())
         return States.MANAGE_ASSISTANTS
     
-    assistants = get_all_assistants()
+    assistants = await get_all_assistants_async()
     if any(a.get("username") == new_user for a in assistants):
         await update.message.reply_text("⚠️ اسم المستخدم موجود مسبقاً. اختر اسمًا آخر:", reply_markup=cancel_or_back_kb())
         return States.CREATE_ASSISTANT_USER
@@ -2312,7 +4230,7 @@ async def create_assistant_pass(update: Update, context: ContextTypes.DEFAULT_TY
         return States.MANAGE_ASSISTANTS
     
     new_user = context.user_data.get("new_assistant_user")
-    if add_assistant(new_user, new_pass):
+    if await add_assistant_async(new_user, new_pass):
         await update.message.reply_text(
             f"✅ تم إضافة المشرف {new_user} بنجاح.",
             reply_markup=assistants_management_kb()
@@ -2330,7 +4248,7 @@ async def delete_assistant_menu(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("تم الإلغاء.", reply_markup=assistants_management_kb())
         return States.MANAGE_ASSISTANTS
     
-    if delete_assistant(assistant_to_delete):
+    if await delete_assistant_async(assistant_to_delete):
         await update.message.reply_text(
             f"✅ تم حذف المشرف {assistant_to_delete} بنجاح.",
             reply_markup=assistants_management_kb()
@@ -2361,7 +4279,7 @@ async def update_assistant_password_handler(update: Update, context: ContextType
         return States.MANAGE_ASSISTANTS
     
     user_to_change = context.user_data.get("change_pass_user")
-    if update_assistant_password(user_to_change, new_password):
+    if await update_assistant_password_async(user_to_change, new_password):
         await update.message.reply_text(
             f"✅ تم تغيير كلمة المرور للمشرف {user_to_change} بنجاح.",
             reply_markup=assistants_management_kb()
@@ -2378,25 +4296,24 @@ async def update_assistant_password_handler(update: Update, context: ContextType
 # =========================
 
 async def manage_delivery_reports_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
     text = update.message.text
     
     if text == "⬇️ تنزيل الكشوفات":
-        deliveries = get_all_deliveries()
-        if not deliveries:
+        counters = await get_stats_counters_async()
+        if not counters["deliveries"]:
             await update.message.reply_text("⚠️ لا توجد كشوفات تسليم حتى الآن.", reply_markup=delivery_reports_kb())
             return States.MANAGE_DELIVERY_REPORTS
         
-        filename = export_deliveries_to_csv()
-        await update.message.reply_document(
-            document=open(filename, "rb"),
-            filename="deliveries.csv",
-            caption="📥 كشوفات التسليم"
-        )
-        os.remove(filename)
+        with await export_deliveries_to_csv_async() as export_file:
+            await update.message.reply_document(
+                document=export_file,
+                filename="deliveries.csv",
+                caption="📥 كشوفات التسليم"
+            )
         return States.MANAGE_DELIVERY_REPORTS
     
     elif text == "🗑️ حذف الكشوفات":
@@ -2408,8 +4325,15 @@ async def manage_delivery_reports_menu(update: Update, context: ContextTypes.DEF
         return States.CONFIRM_DELETE_DELIVERIES
     
     elif text == "📤 رفع ملف CSV":
+        if not await get_active_campaign_async():
+            await update.message.reply_text(
+                "⚠️ لا توجد جولة توزيع مفتوحة. افتح جولة من '🗓️ جولات التوزيع' أولاً.",
+                reply_markup=delivery_reports_kb()
+            )
+            return States.MANAGE_DELIVERY_REPORTS
+        
         await update.message.reply_text(
-            "📤 أرسل ملف CSV الذي يحتوي على بيانات التسليمات.\n\n"
+            "📤 أرسل ملف CSV الذي يحتوي على بيانات التسليمات (ستضاف للجولة المفتوحة).\n\n"
             "⚠️ يجب أن يحتوي الملف على الأعمدة التالية:\n"
             "• المشرف\n• رقم_الجواز\n• اسم_العضو\n• تاريخ_التسليم",
             reply_markup=upload_csv_kb()
@@ -2417,24 +4341,29 @@ async def manage_delivery_reports_menu(update: Update, context: ContextTypes.DEF
         return States.UPLOAD_DELIVERIES_CSV_FILE
     
     elif text == "📊 عرض الملخص":
-        deliveries = get_all_deliveries()
-        if not deliveries:
+        # ملخص الجولة المفتوحة، أو جميع الجولات إن لم توجد جولة مفتوحة
+        campaign = await get_active_campaign_async()
+        by_supervisor = await get_deliveries_summary_by_supervisor_async(campaign["id"] if campaign else None)
+        if not by_supervisor:
             await update.message.reply_text("⚠️ لا توجد كشوفات تسليم حتى الآن.", reply_markup=delivery_reports_kb())
             return States.MANAGE_DELIVERY_REPORTS
         
-        total = len(deliveries)
-        assistants = {}
-        for delivery in deliveries:
-            assistant = delivery.get("supervisor", "غير معروف")
-            assistants[assistant] = assistants.get(assistant, 0) + 1
+        total = sum(count for _, count in by_supervisor)
         
-        report = f"📊 ملخص التسليمات:\n\nإجمالي التسليمات: {total}\n\nالتوزيع حسب المشرف:\n"
-        for assistant, count in assistants.items():
+        title = f"ملخص الجولة: {campaign['name']}" if campaign else "ملخص التسليمات (جميع الجولات)"
+        report = f"📊 {title}\n\nإجمالي التسليمات: {total}\n\nالتوزيع حسب المشرف:\n"
+        for assistant, count in by_supervisor:
             report += f"- {assistant}: {count}\n"
         
         await update.message.reply_text(report, reply_markup=delivery_reports_kb())
         return States.MANAGE_DELIVERY_REPORTS
     
+    elif text == "🗓️ جولات التوزيع":
+        campaign = await get_active_campaign_async()
+        status = f"🟢 الجولة المفتوحة: {campaign['name']}" if campaign else "⚪ لا توجد جولة مفتوحة حالياً."
+        await update.message.reply_text(f"🗓️ جولات التوزيع:\n\n{status}", reply_markup=campaigns_kb())
+        return States.MANAGE_CAMPAIGNS
+    
     elif text == "🔙 رجوع":
         await update.message.reply_text("⬅️ رجعت للقائمة الرئيسية للأدمن.", reply_markup=admin_menu_kb())
         return States.ADMIN_MENU
@@ -2450,7 +4379,7 @@ async def handle_deliveries_csv_upload(update: Update, context: ContextTypes.DEF
         file_path = os.path.join(TEMP_CSV_DIR, f"deliveries_upload_{update.update_id}.csv")
         await file.download_to_drive(file_path)
         
-        is_valid, message, csv_data = validate_deliveries_csv(file_path)
+        is_valid, message, _ = await validate_deliveries_csv_async(file_path)
         
         if not is_valid:
             os.remove(file_path)
@@ -2460,11 +4389,14 @@ async def handle_deliveries_csv_upload(update: Update, context: ContextTypes.DEF
             )
             return States.MANAGE_DELIVERY_REPORTS
         
-        added_count, errors = import_deliveries_from_csv(csv_data)
+        added_count, errors = await import_deliveries_from_csv_async(iter_deliveries_csv(file_path))
         
         os.remove(file_path)
         
-        result_message = f"✅ تم رفع البيانات بنجاح!\n\n"
+        if added_count or not errors:
+            result_message = f"✅ تم رفع البيانات بنجاح!\n\n"
+        else:
+            result_message = f"❌ لم يتم استيراد أي تسليم.\n\n"
         result_message += f"📊 النتائج:\n"
         result_message += f"• عدد التسليمات المضافة: {added_count}\n"
         
@@ -2490,7 +4422,7 @@ async def handle_deliveries_csv_upload(update: Update, context: ContextTypes.DEF
 
 async def delete_delivery_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text == "✅ نعم، احذف الكشوفات":
-        if delete_all_deliveries():
+        if await delete_all_deliveries_async():
             await update.message.reply_text("✅ تم حذف جميع كشوفات التسليم.", reply_markup=delivery_reports_kb())
         else:
             await update.message.reply_text("❌ حدث خطأ في حذف الكشوفات.", reply_markup=delivery_reports_kb())
@@ -2498,37 +4430,170 @@ async def delete_delivery_reports(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text("❌ تم إلغاء حذف الكشوفات.", reply_markup=delivery_reports_kb())
     return States.MANAGE_DELIVERY_REPORTS
 
+# =========================
+# جولات التوزيع
+# =========================
+
+async def manage_campaigns_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+        await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
+        return ConversationHandler.END
+    
+    text = update.message.text
+    
+    if text == "🆕 فتح جولة جديدة":
+        campaign = await get_active_campaign_async()
+        note = f"\n\n⚠️ سيتم إغلاق الجولة الحالية ({campaign['name']}) تلقائياً." if campaign else ""
+        await update.message.reply_text(f"📝 أدخل اسم الجولة الجديدة:{note}", reply_markup=cancel_or_back_kb())
+        return States.OPEN_CAMPAIGN_NAME
+    
+    elif text == "🔒 إغلاق الجولة الحالية":
+        closed, campaign = await close_active_campaign_async()
+        if not closed:
+            await update.message.reply_text("❌ حدث خطأ في إغلاق الجولة.", reply_markup=campaigns_kb())
+        elif campaign:
+            await update.message.reply_text(
+                f"🔒 تم إغلاق الجولة: {campaign['name']}\n\n"
+                "لن يتمكن المشرفون من تسجيل التسليمات حتى تفتح جولة جديدة.",
+                reply_markup=campaigns_kb()
+            )
+        else:
+            await update.message.reply_text("⚠️ لا توجد جولة مفتوحة.", reply_markup=campaigns_kb())
+        return States.MANAGE_CAMPAIGNS
+    
+    elif text == "📋 عرض الجولات":
+        campaigns = await get_campaigns_async(CAMPAIGNS_LIST_LIMIT)
+        if not campaigns:
+            await update.message.reply_text("⚠️ لا توجد جولات حتى الآن.", reply_markup=campaigns_kb())
+            return States.MANAGE_CAMPAIGNS
+        
+        report = "🗓️ جولات التوزيع:\n"
+        for campaign in campaigns:
+            report += (
+                f"\n{format_campaign_label(campaign)}\n"
+                f"   📦 التسليمات: {campaign['deliveries']}\n"
+                f"   📅 الفتح: {campaign['opened_at']}\n"
+            )
+            if campaign["closed_at"]:
+                report += f"   🔒 الإغلاق: {campaign['closed_at']}\n"
+        
+        await update.message.reply_text(report, reply_markup=campaigns_kb())
+        return States.MANAGE_CAMPAIGNS
+    
+    elif text == "📥 تصدير جولة":
+        campaigns = await get_campaigns_async(CAMPAIGNS_LIST_LIMIT)
+        if not campaigns:
+            await update.message.reply_text("⚠️ لا توجد جولات حتى الآن.", reply_markup=campaigns_kb())
+            return States.MANAGE_CAMPAIGNS
+        
+        await update.message.reply_text("📥 اختر الجولة:", reply_markup=campaigns_selection_kb(campaigns))
+        return States.SELECT_CAMPAIGN_FOR_EXPORT
+    
+    elif text == "🔙 رجوع":
+        await update.message.reply_text("📋 إدارة كشوفات التسليم:", reply_markup=delivery_reports_kb())
+        return States.MANAGE_DELIVERY_REPORTS
+    
+    return States.MANAGE_CAMPAIGNS
+
+async def open_campaign_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+        await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
+        return ConversationHandler.END
+    
+    name = update.message.text.strip()
+    if name in ("🔙 رجوع", "❌ إلغاء"):
+        await update.message.reply_text("تم الإلغاء.", reply_markup=campaigns_kb())
+        return States.MANAGE_CAMPAIGNS
+    
+    campaign, closed = await open_campaign_async(name)
+    if not campaign:
+        await update.message.reply_text("❌ حدث خطأ في فتح الجولة.", reply_markup=campaigns_kb())
+        return States.MANAGE_CAMPAIGNS
+    
+    message = f"✅ تم فتح الجولة: {campaign['name']}"
+    if closed:
+        message += f"\n🔒 وتم إغلاق الجولة السابقة: {closed['name']}"
+    await update.message.reply_text(message, reply_markup=campaigns_kb())
+    return States.MANAGE_CAMPAIGNS
+
+async def select_campaign_for_export_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "main_admin":
+        await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
+        return ConversationHandler.END
+    
+    text = update.message.text
+    if text == "🔙 رجوع":
+        await update.message.reply_text("🗓️ جولات التوزيع:", reply_markup=campaigns_kb())
+        return States.MANAGE_CAMPAIGNS
+    
+    campaign_id = parse_campaign_label(text)
+    campaign = await get_campaign_async(campaign_id) if campaign_id is not None else None
+    if not campaign:
+        await update.message.reply_text("⚠️ يرجى اختيار جولة من القائمة.")
+        return States.SELECT_CAMPAIGN_FOR_EXPORT
+    
+    by_supervisor = await get_deliveries_summary_by_supervisor_async(campaign["id"])
+    if not by_supervisor:
+        await update.message.reply_text(f"⚠️ لا توجد تسليمات في الجولة: {campaign['name']}", reply_markup=campaigns_kb())
+        return States.MANAGE_CAMPAIGNS
+    
+    total = sum(count for _, count in by_supervisor)
+    caption = f"📥 كشوفات الجولة: {campaign['name']}\n\nإجمالي التسليمات: {total}\n"
+    for assistant, count in by_supervisor:
+        caption += f"- {assistant}: {count}\n"
+    
+    with await export_campaign_deliveries_to_csv_async(campaign["id"]) as export_file:
+        await update.message.reply_document(
+            document=export_file,
+            filename=f"campaign_{campaign['id']}_deliveries.csv",
+            caption=caption[:1024]
+        )
+    await update.message.reply_text("🗓️ جولات التوزيع:", reply_markup=campaigns_kb())
+    return States.MANAGE_CAMPAIGNS
+
 # =========================
 # تسجيل التسليم للمشرفين
 # =========================
 
 async def record_delivery_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "assistant":
+        await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
+        return ConversationHandler.END
+    
     passport = update.message.text.strip()
     if passport in ("🔙 رجوع", "❌ إلغاء"):
         await update.message.reply_text("تم الإلغاء.", reply_markup=assistant_menu_kb())
         return States.ASSISTANT_MENU
     
-    member = get_member_by_passport(passport)
+    # الاختيار من البحث المضمن يتجاوز زر التسجيل الذي يتحقق من وجود جولة مفتوحة
+    if update.message.via_bot and not await get_active_campaign_async():
+        await update.message.reply_text(
+            "⚠️ لا توجد جولة توزيع مفتوحة حالياً. يرجى مراجعة الإدارة.",
+            reply_markup=assistant_menu_kb()
+        )
+        return States.ASSISTANT_MENU
+    
+    member = await get_member_by_passport_async(passport)
     
     if not member:
         await update.message.reply_text("⚠️ لم يتم العثور على العضو. تأكد من رقم الجواز.", reply_markup=cancel_or_back_kb())
         return States.RECORD_DELIVERY_PASSPORT
     
-    existing_delivery = check_existing_delivery(passport)
+    existing_delivery = await check_existing_delivery_async(passport)
     if existing_delivery:
         warning_message = (
-            f"⚠️ تحذير: العضو {member.get('name')} تم تسليمه من قبل!\n\n"
+            f"⚠️ تحذير: العضو {member.get('name')} تم تسليمه من قبل في هذه الجولة!\n\n"
             f"المشرف: {existing_delivery.get('supervisor')}\n"
             f"التاريخ: {existing_delivery.get('delivery_date')}\n\n"
             f"هل تريد تسليمه مرة أخرى؟"
         )
-        context.user_data["pending_delivery_passport"] = passport
+        context.user_data["pending_delivery_passport"] = member["passport"]
         context.user_data["pending_delivery_name"] = member.get("name")
         
         await update.message.reply_text(warning_message, reply_markup=confirm_delivery_kb())
         return States.CONFIRM_DELIVERY
     
-    context.user_data["pending_delivery_passport"] = passport
+    context.user_data["pending_delivery_passport"] = member["passport"]
     context.user_data["pending_delivery_name"] = member.get("name")
     
     await update.message.reply_text(
@@ -2546,14 +4611,14 @@ async def record_delivery_confirm(update: Update, context: ContextTypes.DEFAULT_
         name = context.user_data.get("pending_delivery_name")
         assistant_user = context.user_data.get("login_user")
         
-        if add_delivery(assistant_user, passport, name):
+        if await add_delivery_async(assistant_user, passport, name):
             await update.message.reply_text(
                 "✅ تم تسجيل التسليم بنجاح.",
                 reply_markup=assistant_menu_kb()
             )
         else:
             await update.message.reply_text(
-                "❌ حدث خطأ في تسجيل التسليم.",
+                "❌ لم يتم تسجيل التسليم. تأكد من وجود جولة توزيع مفتوحة.",
                 reply_markup=assistant_menu_kb()
             )
         return States.ASSISTANT_MENU
@@ -2562,50 +4627,36 @@ async def record_delivery_confirm(update: Update, context: ContextTypes.DEFAULT_
         return States.ASSISTANT_MENU
 
 async def assistant_view_deliveries_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not validate_admin_session(context):
+    if not await validate_admin_session(context):
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
     
     text = update.message.text
     assistant_user = context.user_data.get("login_user")
-    assistant_deliveries = get_deliveries_by_supervisor(assistant_user)
     
     if text == "📥 تحميل":
-        if not assistant_deliveries:
+        if not await count_supervisor_deliveries_async(assistant_user):
             await update.message.reply_text("⚠️ لا توجد تسليمات مسجلة حتى الآن.", reply_markup=assistant_delivery_reports_kb())
             return States.ASSISTANT_VIEW_DELIVERIES
         
-        os.makedirs(TEMP_CSV_DIR, exist_ok=True)
-        temp_filename = os.path.join(TEMP_CSV_DIR, f"{assistant_user}_deliveries.csv")
-        
-        with open(temp_filename, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["المشرف", "رقم_الجواز", "اسم_العضو", "تاريخ_التسليم"])
-            for delivery in assistant_deliveries:
-                writer.writerow([delivery["supervisor"], delivery["passport"], delivery["member_name"], delivery["delivery_date"]])
-        
-        await update.message.reply_document(
-            document=open(temp_filename, "rb"),
-            filename=f"{assistant_user}_deliveries.csv",
-            caption="📥 كشوفات التسليم"
-        )
-        
-        os.remove(temp_filename)
+        with await export_supervisor_deliveries_to_csv_async(assistant_user) as export_file:
+            await update.message.reply_document(
+                document=export_file,
+                filename=f"{assistant_user}_deliveries.csv",
+                caption="📥 كشوفات التسليم"
+            )
         return States.ASSISTANT_VIEW_DELIVERIES
     
     elif text == "📊 ملخص":
-        if not assistant_deliveries:
+        dates = await get_supervisor_deliveries_by_date_async(assistant_user)
+        if not dates:
             await update.message.reply_text("⚠️ لا توجد تسليمات مسجلة حتى الآن.", reply_markup=assistant_delivery_reports_kb())
             return States.ASSISTANT_VIEW_DELIVERIES
         
-        total = len(assistant_deliveries)
-        dates = {}
-        for delivery in assistant_deliveries:
-            date_str = delivery.get("delivery_date", "").split(" ")[0]
-            dates[date_str] = dates.get(date_str, 0) + 1
+        total = sum(count for _, count in dates)
         
         report = f"📊 ملخص تسليماتك:\n\nإجمالي التسليمات: {total}\n\nالتوزيع حسب التاريخ:\n"
-        for date_str, count in dates.items():
+        for date_str, count in dates:
             report += f"- {date_str}: {count}\n"
         
         await update.message.reply_text(report, reply_markup=assistant_delivery_reports_kb())
@@ -2617,6 +4668,203 @@ async def assistant_view_deliveries_handler(update: Update, context: ContextType
     
     return States.ASSISTANT_VIEW_DELIVERIES
 
+# =========================
+# تسليم الدفعات
+# =========================
+
+def format_batch_delivery_summary(batch: Dict[str, List]) -> str:
+    """ملخص مجموعات الدفعة مع عرض عدد محدود من الأسماء في كل مجموعة"""
+    def preview(lines: List[str]) -> str:
+        shown = "".join(f"• {line}\n" for line in lines[:BATCH_DELIVERY_PREVIEW_SIZE])
+        if len(lines) > BATCH_DELIVERY_PREVIEW_SIZE:
+            shown += f"• ... و{len(lines) - BATCH_DELIVERY_PREVIEW_SIZE} آخرين\n"
+        return shown
+    
+    summary = "🗂️ نتيجة مطابقة الدفعة:\n"
+    summary += f"\n✅ جاهز للتسليم: {len(batch['ready'])}\n"
+    summary += preview([f"{member['name']} ({member['passport']})" for member in batch["ready"]])
+    if batch["delivered"]:
+        summary += f"\n⚠️ تم تسليمهم في هذه الجولة: {len(batch['delivered'])}\n"
+        summary += preview([
+            f"{member['name']} — {member['supervisor']} ({member['delivery_date']})"
+            for member in batch["delivered"]
+        ])
+    if batch["missing"]:
+        summary += f"\n❌ غير مسجلين: {len(batch['missing'])}\n"
+        summary += preview(batch["missing"])
+    if batch["duplicates"]:
+        summary += f"\n🔁 مكرر في الدفعة (تم تجاهله): {len(batch['duplicates'])}\n"
+    return summary
+
+async def batch_delivery_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "assistant":
+        await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
+        return ConversationHandler.END
+    
+    if update.message.document:
+        if (update.message.document.file_size or 0) > BATCH_DELIVERY_MAX_FILE_SIZE:
+            await update.message.reply_text(
+                f"⚠️ حجم الملف أكبر من المسموح ({BATCH_DELIVERY_MAX_FILE_SIZE // 1024} كيلوبايت). قسّمه وأعد الإرسال.",
+                reply_markup=cancel_or_back_kb()
+            )
+            return States.BATCH_DELIVERY_INPUT
+        
+        file = await update.message.document.get_file()
+        
+        os.makedirs(TEMP_CSV_DIR, exist_ok=True)
+        file_path = os.path.join(TEMP_CSV_DIR, f"batch_delivery_{update.update_id}.csv")
+        await file.download_to_drive(file_path)
+        try:
+            passports = await read_passports_csv_async(file_path, BATCH_DELIVERY_MAX_SIZE)
+        except (UnicodeDecodeError, csv.Error) as e:
+            logger.error(f"Error reading batch delivery file: {e}")
+            passports = []
+        finally:
+            os.remove(file_path)
+    elif update.message.text:
+        passports = parse_passport_list(update.message.text)
+    else:
+        passports = []
+    
+    if not passports:
+        await update.message.reply_text(
+            "⚠️ لم يتم العثور على أرقام جوازات. الصق رقماً في كل سطر أو أرسل ملف CSV.",
+            reply_markup=cancel_or_back_kb()
+        )
+        return States.BATCH_DELIVERY_INPUT
+    
+    if len(passports) > BATCH_DELIVERY_MAX_SIZE:
+        await update.message.reply_text(
+            f"⚠️ الدفعة تتجاوز الحد الأقصى ({BATCH_DELIVERY_MAX_SIZE} جواز). قسّمها وأعد الإرسال.",
+            reply_markup=cancel_or_back_kb()
+        )
+        return States.BATCH_DELIVERY_INPUT
+    
+    batch = await resolve_delivery_batch_async(passports)
+    summary = format_batch_delivery_summary(batch)
+    
+    if not batch["ready"]:
+        context.user_data.pop("pending_batch_delivery", None)
+        await update.message.reply_text(
+            f"{summary}\nلا يوجد أعضاء جاهزون للتسليم في هذه الدفعة.",
+            reply_markup=assistant_menu_kb()
+        )
+        return States.ASSISTANT_MENU
+    
+    context.user_data["pending_batch_delivery"] = batch["ready"]
+    await update.message.reply_text(
+        f"{summary}\nهل تريد تسجيل التسليم لـ {len(batch['ready'])} عضو؟",
+        reply_markup=confirm_batch_delivery_kb()
+    )
+    return States.CONFIRM_BATCH_DELIVERY
+
+async def batch_delivery_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    members = context.user_data.pop("pending_batch_delivery", [])
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "assistant":
+        await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
+        return ConversationHandler.END
+    
+    if update.message.text.strip() != "✅ نعم - تسجيل الدفعة" or not members:
+        await update.message.reply_text("❌ تم إلغاء تسجيل الدفعة.", reply_markup=assistant_menu_kb())
+        return States.ASSISTANT_MENU
+    
+    added = await add_deliveries_batch_async(context.user_data.get("login_user"), members)
+    if not added:
+        await update.message.reply_text(
+            "❌ لم يتم تسجيل الدفعة. تأكد من وجود جولة توزيع مفتوحة.",
+            reply_markup=assistant_menu_kb()
+        )
+        return States.ASSISTANT_MENU
+    
+    message = f"✅ تم تسجيل {added} تسليم بنجاح."
+    if added < len(members):
+        message += f"\n⚠️ تم تخطي {len(members) - added} عضو سُلّم له في هذه الجولة أثناء المراجعة."
+    await update.message.reply_text(message, reply_markup=assistant_menu_kb())
+    return States.ASSISTANT_MENU
+
+# =========================
+# البحث عن الأعضاء
+# =========================
+
+def format_member_search_results(members: List[Dict], offset: int) -> str:
+    """تنسيق صفحة من نتائج البحث"""
+    lines = []
+    for i, member in enumerate(members, offset + 1):
+        lines.append(
+            f"{i}. 👤 {member['name']}\n"
+            f"   🛂 {member['passport']} | 📞 {member['phone'] or '-'}\n"
+            f"   🏠 {member['address'] or '-'} | 💼 {member['role'] or '-'} | 👨‍👩‍👧‍👦 {member['family_members']}"
+        )
+    return "\n\n".join(lines)
+
+async def member_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await validate_admin_session(context):
+        await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
+        return ConversationHandler.END
+    
+    text = update.message.text.strip()
+    if text == "➡️ النتائج التالية" and context.user_data.get("member_search_query"):
+        query = context.user_data["member_search_query"]
+        offset = context.user_data.get("member_search_offset", 0) + MEMBER_SEARCH_PAGE_SIZE
+    else:
+        query = text
+        offset = 0
+    
+    # صف إضافي لمعرفة وجود صفحة تالية دون عد كل النتائج
+    members = await search_members_async(query, MEMBER_SEARCH_PAGE_SIZE + 1, offset)
+    has_more = len(members) > MEMBER_SEARCH_PAGE_SIZE
+    members = members[:MEMBER_SEARCH_PAGE_SIZE]
+    
+    if not members:
+        context.user_data.pop("member_search_query", None)
+        message = "⚠️ لا توجد نتائج أخرى." if offset else "⚠️ لم يتم العثور على أعضاء مطابقين. جرب كلمات أخرى:"
+        await update.message.reply_text(message, reply_markup=cancel_or_back_kb())
+        return States.SEARCH_MEMBERS
+    
+    context.user_data["member_search_query"] = query
+    context.user_data["member_search_offset"] = offset
+    
+    footer = "\n\nأدخل كلمات بحث جديدة أو اضغط النتائج التالية." if has_more else "\n\nأدخل كلمات بحث جديدة أو ارجع للقائمة."
+    await update.message.reply_text(
+        f"🔍 نتائج البحث ({offset + 1}-{offset + len(members)}):\n\n"
+        + format_member_search_results(members, offset)
+        + footer,
+        reply_markup=member_search_kb() if has_more else cancel_or_back_kb()
+    )
+    return States.SEARCH_MEMBERS
+
+# =========================
+# البحث المضمن (inline)
+# =========================
+
+async def inline_member_lookup(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """اقتراح الأعضاء أثناء كتابة @bot ثم رقم الجواز أو الاسم؛ اختيار النتيجة يرسل رقم الجواز"""
+    inline_query = update.inline_query
+    # الاختيار يسجل تسليماً، وهذا متاح للمشرفين (assistant) فقط
+    if not await validate_admin_session(context) or context.user_data.get("user_type") != "assistant":
+        await inline_query.answer(
+            [],
+            cache_time=0,
+            is_personal=True,
+            button=InlineQueryResultsButton(text="🔑 سجل الدخول أولاً", start_parameter="login"),
+        )
+        return
+    
+    text = inline_query.query.strip()
+    members = await lookup_members_cached(text) if text else []
+    results = [
+        InlineQueryResultArticle(
+            id=str(member["id"]),
+            title=member["name"],
+            description=f"🛂 {member['passport']} | 📞 {member['phone'] or '-'} | 👨‍👩‍👧‍👦 {member['family_members']}",
+            input_message_content=InputTextMessageContent(member["passport"]),
+        )
+        for member in members
+    ]
+    # لا تخزين لدى Telegram: النتائج تحتوي بيانات الأعضاء ويجب أن تتوقف فور انتهاء الجلسة،
+    # والتخزين المؤقت للاستعلامات المتكررة يتم داخل البوت (inline_lookup_cache)
+    await inline_query.answer(results, cache_time=0, is_personal=True)
+
 # =========================
 # وظائف مساعدة إضافية
 # =========================
@@ -2632,20 +4880,74 @@ async def back_to_admin_only(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("⚠️ ليس لديك صلاحيات.", reply_markup=main_menu_kb())
         return ConversationHandler.END
 
+async def db_maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """مهمة دورية لإبقاء ملف WAL محدود الحجم"""
+    try:
+        busy, log_frames, checkpointed = await run_db(run_db_maintenance)
+        logger.info(f"DB maintenance: checkpointed {checkpointed}/{log_frames} WAL frames (busy={busy})")
+        purged = await purge_expired_sessions_async()
+        if purged:
+            logger.info(f"Purged {purged} expired or revoked sessions")
+        cache = member_cache.stats()
+        logger.info(
+            f"Member cache: {cache['size']} entries, {cache['hits']} hits, "
+            f"{cache['negative_hits']} negative hits, {cache['misses']} misses"
+        )
+    except Exception as e:
+        logger.error(f"Error running DB maintenance: {e}")
+
+async def post_init(application: Application):
+    """استئناف مهام الخلفية بعد تشغيل البوت"""
+    await resume_broadcast_jobs(application.bot)
+
+async def post_stop(application: Application):
+    """إيقاف مهام البث قبل إغلاق البوت"""
+    await stop_broadcast_jobs()
+
+async def post_shutdown(application: Application):
+    """إيقاف منفذ قاعدة البيانات وإغلاق الاتصالات عند إيقاف البوت"""
+    try:
+        await run_db(run_db_maintenance)
+    except Exception as e:
+        logger.error(f"Error running final DB maintenance: {e}")
+    await asyncio.get_running_loop().run_in_executor(None, shutdown_db_executor)
+    close_db_pool()
+
 # =========================
 # Main function
 # =========================
 
-def main():
-    # تهيئة قاعدة البيانات
-    init_database()
-    
-    # إنشاء مجلد CSV المؤقت
-    os.makedirs(TEMP_CSV_DIR, exist_ok=True)
+@contextmanager
+def startup_phase(name: str, timings: List[Tuple[str, float]]):
+    """قياس زمن مرحلة من مراحل بدء التشغيل"""
+    started = time.perf_counter()
+    yield
+    timings.append((name, time.perf_counter() - started))
+
+def build_application() -> Application:
+    """إنشاء التطبيق وتسجيل المهام والـ handlers"""
+    persistence = SQLitePersistence()
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .persistence(persistence)
+        .concurrent_updates(PerChatUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
-    # إنشاء التطبيق
-    persistence = PicklePersistence(filepath="conversationbot")
-    application = Application.builder().token(TOKEN).persistence(persistence).build()
+    # مهمة صيانة قاعدة البيانات الدورية
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            db_maintenance_job,
+            interval=DB_MAINTENANCE_INTERVAL,
+            first=DB_MAINTENANCE_INTERVAL,
+            name="db_maintenance",
+        )
+    else:
+        logger.warning("JobQueue is not available; install python-telegram-bot[job-queue] to enable DB maintenance")
     
     # تسجيل handlers المحادثة
     conv_handler = ConversationHandler(
@@ -2701,6 +5003,9 @@ def main():
             States.MANAGE_DELIVERY_REPORTS: [MessageHandler(filters.TEXT, manage_delivery_reports_menu)],
             States.UPLOAD_DELIVERIES_CSV_FILE: [MessageHandler(filters.ALL, handle_deliveries_csv_upload)],
             States.CONFIRM_DELETE_DELIVERIES: [MessageHandler(filters.TEXT, delete_delivery_reports)],
+            States.MANAGE_CAMPAIGNS: [MessageHandler(filters.TEXT, manage_campaigns_menu)],
+            States.OPEN_CAMPAIGN_NAME: [MessageHandler(filters.TEXT, open_campaign_handler)],
+            States.SELECT_CAMPAIGN_FOR_EXPORT: [MessageHandler(filters.TEXT, select_campaign_for_export_handler)],
             States.STATS_MENU: [MessageHandler(filters.TEXT, admin_stats_choice_handler)],
             States.CONFIRM_DELETE_STATS: [MessageHandler(filters.TEXT, admin_delete_stats)],
             States.MANAGE_SERVICES: [MessageHandler(filters.TEXT, manage_services_menu)],
@@ -2714,10 +5019,19 @@ def main():
             States.CONFIRM_DELETE_SINGLE_SERVICE: [MessageHandler(filters.TEXT, confirm_delete_single_service_handler)],
             States.CONFIRM_DELETE_SERVICE_REPORT: [MessageHandler(filters.TEXT, confirm_delete_all_services_handler)],
             States.BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.Text(["❌ إلغاء", "🔙 رجوع"]), admin_broadcast)],
-            States.ASSISTANT_MENU: [MessageHandler(filters.TEXT, admin_menu_handler)],
+            States.ASSISTANT_MENU: [
+                # رقم جواز مختار من البحث المضمن ينتقل مباشرة لتأكيد التسليم
+                MessageHandler(filters.VIA_BOT & filters.TEXT, record_delivery_process),
+                MessageHandler(filters.TEXT, admin_menu_handler),
+            ],
             States.RECORD_DELIVERY_PASSPORT: [MessageHandler(filters.TEXT & ~filters.Text(["❌ إلغاء", "🔙 رجوع"]), record_delivery_process)],
             States.CONFIRM_DELIVERY: [MessageHandler(filters.TEXT, record_delivery_confirm)],
+            States.BATCH_DELIVERY_INPUT: [
+                MessageHandler((filters.TEXT | filters.Document.ALL) & ~filters.Text(["❌ إلغاء", "🔙 رجوع"]), batch_delivery_input)
+            ],
+            States.CONFIRM_BATCH_DELIVERY: [MessageHandler(filters.TEXT, batch_delivery_confirm)],
             States.ASSISTANT_VIEW_DELIVERIES: [MessageHandler(filters.TEXT, assistant_view_deliveries_handler)],
+            States.SEARCH_MEMBERS: [MessageHandler(filters.TEXT & ~filters.Text(["❌ إلغاء", "🔙 رجوع"]), member_search_handler)],
         },
         fallbacks=[
             MessageHandler(filters.Text(["❌ إلغاء"]), go_main_menu),
@@ -2736,6 +5050,7 @@ def main():
     application.add_handler(MessageHandler(filters.Text(["❌ إلغاء"]), go_main_menu))
     application.add_handler(MessageHandler(filters.Text(["🔙 رجوع"]), go_main_menu))
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(InlineQueryHandler(inline_member_lookup))
     application.add_handler(MessageHandler(filters.Text(["ℹ️ عن المنصة"]), about))
     application.add_handler(MessageHandler(filters.Text(["📞 تواصل معنا"]), contact_menu))
     application.add_handler(MessageHandler(filters.Text(["📞 الهاتف"]), contact_phone))
@@ -2743,10 +5058,70 @@ def main():
     application.add_handler(MessageHandler(filters.Text(["📱 واتساب"]), contact_whatsapp))
     application.add_handler(MessageHandler(filters.Text(["📘 فيسبوك"]), contact_facebook))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, show_admin_login))
+    return application
+
+def run_webhook(application: Application):
+    """تشغيل البوت بخادم webhook مدمج يتحقق من الرمز السري لكل طلب"""
+    if not WEBHOOK_URL:
+        logger.error("BOT_MODE=webhook يتطلب WEBHOOK_URL (العنوان العام للبوت بصيغة https).")
+        raise SystemExit(1)
+    
+    secret = WEBHOOK_SECRET
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET is not set; using a random secret for this run")
+    
+    webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+    logger.info(f"Starting webhook server on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+    print("🚀 البوت يعمل الآن عبر webhook بقاعدة بيانات SQLite...")
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=webhook_url,
+        secret_token=secret,
+        allowed_updates=Update.ALL_TYPES,
+    )
+
+def main():
+    """مسار بدء التشغيل الوحيد: التحقق من الإعدادات ثم تهيئة التخزين وبناء التطبيق"""
+    if not TOKEN:
+        logger.error("لم يتم العثور على التوكن! تأكد من إعداد BOT_TOKEN في environment variables.")
+        raise SystemExit(1)
+    
+    timings: List[Tuple[str, float]] = []
+    
+    # مجلدات التخزين
+    with startup_phase("storage", timings):
+        os.makedirs(os.path.dirname(os.path.abspath(DATABASE_FILE)), exist_ok=True)
+        os.makedirs(TEMP_CSV_DIR, exist_ok=True)
+    
+    # تهيئة قاعدة البيانات (تُتخطى إذا كان المخطط محدثاً)
+    with startup_phase("database", timings):
+        init_database()
+    
+    # بناء لوحات المفاتيح الثابتة مسبقاً
+    with startup_phase("keyboards", timings):
+        warm_keyboards()
+    
+    # تحميل جلسات الدخول السارية
+    with startup_phase("sessions", timings):
+        session_store.load()
+    
+    # إنشاء التطبيق
+    with startup_phase("application", timings):
+        application = build_application()
+    
+    logger.info("Startup phases: " + ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in timings))
     
     # بدء البوت
-    print("🚀 البوت يعمل الآن بقاعدة بيانات SQLite...")
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        run_webhook(application)
+    else:
+        if BOT_MODE != "polling":
+            logger.warning(f"Unknown BOT_MODE {BOT_MODE!r}, falling back to polling")
+        print("🚀 البوت يعمل الآن بقاعدة بيانات SQLite...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()